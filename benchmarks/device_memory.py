@@ -0,0 +1,58 @@
+"""Memory benchmark of Device objects at fleet scale
+
+Builds clients with many devices sharing one registers map against an
+in-process fake API and reports the traced memory per device.
+
+    python benchmarks/device_memory.py --devices 1000 10000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run from a checkout without installing the package, like import_time.py.
+sys.path.insert(0, REPO_ROOT)
+
+from pyevacalor import decoding
+from pyevacalor import evacalor
+from pyevacalor.fakeapi import FakeAguaApi
+
+
+def measure(devices, registers):
+    """Return the traced bytes per device of a client with devices."""
+    transport = FakeAguaApi(devices_per_account=devices, registers=registers)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    client = evacalor(
+        FakeAguaApi.account_email(0), "bench", "bench", transport=transport
+    )
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    shared_maps = len(decoding._register_maps)
+    client.close()
+    del client
+    return (after - before) / float(devices), shared_maps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+",
+                        default=[100, 1000])
+    parser.add_argument("--registers", type=int, default=120)
+    args = parser.parse_args(argv)
+
+    print(str.format("{0:>10}{1:>18}{2:>14}", "devices", "bytes/device",
+                     "shared maps"))
+    for devices in args.devices:
+        per_device, shared_maps = measure(devices, args.registers)
+        print(str.format("{0:>10}{1:>18.0f}{2:>14}", devices, per_device,
+                         shared_maps))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Import-time benchmark guarding ``import pyevacalor`` against regressions
+
+Every run imports the package in a fresh interpreter with ``-X importtime``
+and reads the cumulative time reported for pyevacalor. The script fails
+when the median exceeds --max-ms or when importing the package loads a
+heavy dependency or configures logging.
+
+    python benchmarks/import_time.py --runs 20 --max-ms 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORBIDDEN_MODULES = ("requests", "jwt", "urllib3", "http.client")
+
+SIDE_EFFECT_CHECK = """
+import logging, sys
+import pyevacalor
+loaded = [m for m in {forbidden!r} if m in sys.modules]
+handlers = logging.getLogger().handlers
+print(",".join(loaded) + "|" + str(len(handlers)))
+"""
+
+
+def _environment():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [REPO_ROOT, env.get("PYTHONPATH")])
+    )
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def measure_once(env):
+    """Return the cumulative import time of pyevacalor in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pyevacalor"],
+        env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+        universal_newlines=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if parts[2] == "pyevacalor":
+            return int(parts[1])
+    raise RuntimeError("pyevacalor not found in -X importtime output")
+
+
+def check_side_effects(env):
+    """Return a list of side effects of importing pyevacalor."""
+    result = subprocess.run(
+        [sys.executable, "-c",
+         SIDE_EFFECT_CHECK.format(forbidden=FORBIDDEN_MODULES)],
+        env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    loaded, handlers = result.stdout.strip().split("|")
+    problems = list()
+    if loaded:
+        problems.append(str.format("imports heavy modules: {0}", loaded))
+    if int(handlers):
+        problems.append("configures the root logger")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--max-ms", type=float, default=None,
+        help="fail when the median import time exceeds this many ms"
+    )
+    args = parser.parse_args(argv)
+
+    env = _environment()
+    # Warm up the bytecode cache so the first run is not an outlier.
+    measure_once(env)
+    samples = [measure_once(env) / 1000.0 for _ in range(args.runs)]
+
+    median = statistics.median(samples)
+    print(str.format(
+        "import pyevacalor: median {0:.2f} ms, min {1:.2f} ms, "
+        "max {2:.2f} ms over {3} runs",
+        median, min(samples), max(samples), args.runs
+    ))
+
+    failed = False
+    for problem in check_side_effects(env):
+        print(str.format("FAIL: import pyevacalor {0}", problem))
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print(str.format(
+            "FAIL: median import time {0:.2f} ms exceeds {1:.2f} ms",
+            median, args.max_ms
+        ))
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
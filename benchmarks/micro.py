@@ -0,0 +1,221 @@
+"""Micro-benchmarks of the decode, encode and parsing hot paths
+
+Each benchmark is timed with timeit and reported as the best time per
+call over several repeats. Results can be saved as a named baseline and
+later runs compared against it:
+
+    python benchmarks/micro.py --save before
+    python benchmarks/micro.py --compare before --max-slowdown 1.3
+
+By default the inputs are generated by pyevacalor.fakeapi; pass --fixture
+with an NDJSON file written by RecordingTransport to benchmark captured
+deviceGetRegistersMap and deviceJobStatus payloads instead.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run from a checkout without installing the package, like import_time.py.
+sys.path.insert(0, REPO_ROOT)
+
+from pyevacalor import decoding
+from pyevacalor.client import evacalor
+from pyevacalor.const import (
+    API_PATH_DEVICE_JOB_STATUS,
+    API_PATH_DEVICE_REGISTERS_MAP,
+)
+from pyevacalor.fakeapi import (
+    PRODUCT_ID,
+    FakeAguaApi,
+    make_registers_map_response,
+)
+from pyevacalor.transport import STREAM_CHUNK_SIZE
+
+BASELINE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baselines"
+)
+
+DECODED_ITEMS = (
+    'status_get', 'temp_air_get', 'temp_air_set', 'temp_gas_flue_get',
+    'real_power_get', 'power_set', 'alarms_get',
+)
+ENCODED_ITEMS = (('temp_air_set', 21.5), ('power_set', 3))
+
+
+def load_fixture(path):
+    """Return (registers map response bytes, job answer data, map id) from a
+    RecordingTransport fixture.
+    """
+    registers_map_body = None
+    job_answer_data = None
+    with open(path, "r") as fh:
+        for line in fh:
+            exchange = json.loads(line)
+            if exchange['status'] != 200:
+                continue
+            if exchange['path'] == API_PATH_DEVICE_REGISTERS_MAP:
+                registers_map_body = exchange['body']
+            elif (exchange['path'].startswith(API_PATH_DEVICE_JOB_STATUS)
+                  and 'Items' in exchange['body'].get('jobAnswerData', {})):
+                job_answer_data = exchange['body']['jobAnswerData']
+    if registers_map_body is None or job_answer_data is None:
+        raise ValueError(str.format(
+            "{0} holds no registers map and buffer reading", path
+        ))
+    # Pick the map whose offsets best cover the recorded buffer.
+    items = set(job_answer_data['Items'])
+    best = max(
+        registers_map_body['device_registers_map']['registers_map'],
+        key=lambda entry: len(items.intersection(
+            register['offset'] for register in entry['registers']
+        ))
+    )
+    return json.dumps(registers_map_body).encode(), job_answer_data, best['id']
+
+
+def generated_inputs(registers):
+    api = FakeAguaApi(registers=registers)
+    client = evacalor(FakeAguaApi.account_email(0), "bench", "bench",
+                      transport=api)
+    try:
+        device = client.devices[0]
+        job_answer_data = {
+            'Items': device.buffer_items,
+            'Values': device.buffer_values,
+        }
+    finally:
+        client.close()
+    body = json.dumps(make_registers_map_response(registers=registers)).encode()
+    return body, job_answer_data, device.id_registers_map
+
+
+def build_benchmarks(registers_map_body, job_answer_data, id_registers_map):
+    """Return a dict of benchmark name to zero-argument callable."""
+    registers_map_response = json.loads(registers_map_body)
+    register_map = decoding.parse_registers_map(
+        registers_map_response, PRODUCT_ID, id_registers_map
+    )
+    reading = decoding.parse_buffer_reading(job_answer_data)
+    decoded = [item for item in DECODED_ITEMS if item in register_map]
+    encoded = [(item, value) for item, value in ENCODED_ITEMS
+               if item in register_map]
+
+    def decode_items():
+        for item in decoded:
+            decoding.decode_item(register_map, reading, item)
+
+    def encode_values():
+        for item, value in encoded:
+            decoding.encode_value(register_map, item, value)
+
+    def parse_registers_map():
+        decoding.parse_registers_map(
+            registers_map_response, PRODUCT_ID, id_registers_map
+        )
+
+    def load_and_parse_registers_map():
+        decoding.parse_registers_map(
+            json.loads(registers_map_body), PRODUCT_ID, id_registers_map
+        )
+
+    chunks = [
+        registers_map_body[start:start + STREAM_CHUNK_SIZE]
+        for start in range(0, len(registers_map_body), STREAM_CHUNK_SIZE)
+    ]
+
+    def stream_parse_registers_map():
+        decoding.parse_registers_map_stream(
+            chunks, PRODUCT_ID, id_registers_map
+        )
+
+    def parse_buffer_reading():
+        decoding.parse_buffer_reading(job_answer_data)
+
+    return {
+        'decode_items': decode_items,
+        'encode_values': encode_values,
+        'parse_registers_map': parse_registers_map,
+        'load_and_parse_registers_map': load_and_parse_registers_map,
+        'stream_parse_registers_map': stream_parse_registers_map,
+        'parse_buffer_reading': parse_buffer_reading,
+    }
+
+
+def run_benchmarks(benchmarks, repeat):
+    """Return a dict of benchmark name to best seconds per call."""
+    results = dict()
+    for name, func in sorted(benchmarks.items()):
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number))
+        results[name] = best / number
+    return results
+
+
+def _baseline_path(name):
+    return os.path.join(BASELINE_DIR, name + ".json")
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(_baseline_path(name), "w") as fh:
+        json.dump({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+        }, fh, indent=2, sort_keys=True)
+
+
+def load_baseline(name):
+    with open(_baseline_path(name), "r") as fh:
+        return json.load(fh)['results']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixture", help="RecordingTransport NDJSON file")
+    parser.add_argument("--registers", type=int, default=120,
+                        help="registers per generated registers map")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="NAME",
+                        help="store the results as baseline NAME")
+    parser.add_argument("--compare", metavar="NAME",
+                        help="compare the results with baseline NAME")
+    parser.add_argument("--max-slowdown", type=float, default=1.3,
+                        help="fail when a benchmark is this much slower")
+    args = parser.parse_args(argv)
+
+    if args.fixture:
+        inputs = load_fixture(args.fixture)
+    else:
+        inputs = generated_inputs(args.registers)
+    results = run_benchmarks(build_benchmarks(*inputs), args.repeat)
+
+    baseline = load_baseline(args.compare) if args.compare else dict()
+    failed = False
+    print(str.format("{0:<32}{1:>14}{2:>14}{3:>10}", "benchmark", "us/call",
+                     "baseline", "ratio"))
+    for name, seconds in sorted(results.items()):
+        line = str.format("{0:<32}{1:>14.2f}", name, seconds * 1e6)
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += str.format("{0:>14.2f}{1:>9.2f}x", baseline[name] * 1e6,
+                               ratio)
+            if ratio > args.max_slowdown:
+                line += "  REGRESSION"
+                failed = True
+        print(line)
+
+    if args.save:
+        save_baseline(args.save, results)
+        print(str.format("saved baseline {0!r}", args.save))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""Allow running the NDJSON fleet poller with python -m pyevacalor"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,267 @@
+"""Command-line poller streaming Eva Calor device readings as NDJSON
+
+Accounts are read from a file with one JSON object per line, for example::
+
+    {"email": "john.smith@gmail.com", "password": "secret",
+     "unique_id": "1c3be3cd-360c-4c9f-af15-1f79e9ccbc2a"}
+
+Blank lines and lines starting with ``#`` are ignored. Every decoded
+reading is written as a single JSON line as soon as it is available, so
+memory use does not grow with the number of accounts or readings.
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .client import evacalor
+from .exceptions import Error
+from .timings import PHASES, PhaseTimings
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+
+def read_accounts(path):
+    """Lazily yield account dicts from an NDJSON accounts file."""
+    with open(path, "r") as fh:
+        for line_number, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                account = json.loads(line)
+            except ValueError:
+                raise ValueError(str.format(
+                    "Invalid JSON on line {0} of {1}", line_number, path
+                ))
+            for key in ("email", "password", "unique_id"):
+                if key not in account:
+                    raise ValueError(str.format(
+                        "Missing '{0}' on line {1} of {2}",
+                        key, line_number, path
+                    ))
+            yield account
+
+
+class NDJSONWriter(object):
+    """Thread-safe writer emitting one JSON document per line."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()
+            self.count += 1
+
+
+class FleetPoller(object):
+    """Polls the devices of many accounts concurrently."""
+
+    def __init__(self, writer, workers=DEFAULT_WORKERS, count=1,
+                 interval=60.0, timings=None, debug=False):
+        self.writer = writer
+        self.workers = workers
+        self.count = count
+        self.interval = interval
+        self.timings = timings
+        self.debug = debug
+        self.failures = 0
+        self._failures_lock = threading.Lock()
+
+    def run(self, accounts):
+        """Poll every account, keeping at most a bounded number in flight."""
+        max_pending = self.workers * 2
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for account in accounts:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(self._poll_account, account))
+            for future in wait(pending).done:
+                future.result()
+
+    def _poll_account(self, account):
+        try:
+            client = evacalor(
+                account["email"],
+                account["password"],
+                account["unique_id"],
+                debug=self.debug,
+                timings=self.timings,
+            )
+        except Error as err:
+            _LOGGER.error("Polling %s failed: %s", account["email"], err)
+            self._failed()
+            return
+        except Exception:
+            # One bad account must not end the run of the whole fleet.
+            _LOGGER.exception("Error polling %s", account["email"])
+            self._failed()
+            return
+
+        try:
+            self._emit(client.devices)
+            for _ in range(1, self.count):
+                time.sleep(self.interval)
+                devices = list(client.devices)
+                errors = client.update_devices(devices)
+                for device, err in errors.items():
+                    _LOGGER.error(
+                        "Updating device %s failed: %s", device.id_device, err,
+                        exc_info=None if isinstance(err, Error) else err
+                    )
+                    self._failed()
+                self._emit(
+                    [device for device in devices if device not in errors]
+                )
+        except Exception:
+            _LOGGER.exception("Error polling %s", account["email"])
+            self._failed()
+        finally:
+            client.close()
+
+    def _emit(self, devices):
+        for device in devices:
+            self.writer.write(device.get_snapshot())
+
+    def _failed(self):
+        with self._failures_lock:
+            self.failures += 1
+
+
+def format_bench_report(timings, readings, failures, elapsed):
+    """Render the per-phase timings and throughput of a --bench run."""
+    summary = timings.summary()
+    lines = [
+        str.format(
+            "{0:<14}{1:>8}{2:>11}{3:>11}{4:>11}{5:>11}{6:>11}",
+            "phase", "count", "mean ms", "p50 ms", "p90 ms", "p99 ms",
+            "max ms"
+        )
+    ]
+    for phase in PHASES:
+        stats = summary.get(phase)
+        if stats is None:
+            continue
+        lines.append(str.format(
+            "{0:<14}{1:>8}{2:>11.1f}{3:>11.1f}{4:>11.1f}{5:>11.1f}{6:>11.1f}",
+            phase, stats['count'], stats['mean'] * 1000,
+            stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000,
+            stats['max'] * 1000
+        ))
+    lines.append(str.format(
+        "{0} readings, {1} failures in {2:.2f}s: {3:.2f} devices/s",
+        readings, failures, elapsed, readings / elapsed if elapsed else 0.0
+    ))
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pyevacalor",
+        description="Poll Eva Calor devices and stream readings as NDJSON.",
+    )
+    parser.add_argument(
+        "accounts", help="file with one JSON account object per line"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-",
+        help="file to write readings to (default: stdout)"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=DEFAULT_WORKERS,
+        help="number of accounts polled concurrently (per process)"
+    )
+    parser.add_argument(
+        "-n", "--count", type=int, default=1,
+        help="number of polling rounds per account"
+    )
+    parser.add_argument(
+        "-i", "--interval", type=float, default=60.0,
+        help="seconds between polling rounds"
+    )
+    parser.add_argument(
+        "-p", "--processes", type=int, default=1,
+        help="number of worker processes the accounts are spread over"
+    )
+    parser.add_argument(
+        "--bench", action="store_true",
+        help="report per-phase timings and throughput on stderr"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="enable debug logging"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    if args.output == "-":
+        output = sys.stdout
+    else:
+        output = open(args.output, "a")
+
+    timings = PhaseTimings() if args.bench else None
+    writer = NDJSONWriter(output)
+    if args.processes > 1:
+        from .sharded import ShardedPoller
+
+        poller = ShardedPoller(
+            writer,
+            processes=args.processes,
+            workers=args.workers,
+            count=args.count,
+            interval=args.interval,
+            timings=timings,
+            debug=args.debug,
+        )
+    else:
+        poller = FleetPoller(
+            writer,
+            workers=args.workers,
+            count=args.count,
+            interval=args.interval,
+            timings=timings,
+            debug=args.debug,
+        )
+
+    start = time.perf_counter()
+    try:
+        poller.run(read_accounts(args.accounts))
+    except (OSError, ValueError) as err:
+        print(str.format("pyevacalor: {0}", err), file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    if timings is not None:
+        print(
+            format_bench_report(timings, writer.count, poller.failures,
+                                elapsed),
+            file=sys.stderr
+        )
+
+    return 1 if poller.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,478 @@
+"""Client for the Agua IOT platform used by Eva Calor heating devices"""
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import nullcontext
+
+from .const import (
+    API_PATH_APP_SIGNUP,
+    API_PATH_DEVICE_INFO,
+    API_PATH_DEVICE_LIST,
+    API_PATH_LOGIN,
+    API_PATH_REFRESH_TOKEN,
+    API_URL,
+    EVA_CALOR_CUSTOMER_CODE,
+    EVA_COLOR_BRAND_ID,
+    HEADER_ACCEPT,
+    HEADER_CONTENT_TYPE,
+)
+from .device import Device
+from .exceptions import Error, UnauthorizedError
+from .jobs import JobTracker
+from .timings import PHASE_DEVICE_LIST, PHASE_LOGIN
+from .transport import RequestsTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+DeviceChanges = namedtuple('DeviceChanges', ['added', 'removed', 'changed'])
+
+
+def _decode_token(token):
+    import jwt
+
+    return jwt.decode(token, verify=False)
+
+
+class evacalor(object):
+    """Provides access to Eva Calor IOT Agua platform."""
+
+    statusTranslated = {
+        0: "OFF", 1: "START", 2: "LOAD PELLETS", 3: "FLAME LIGHT", 4: "ON",
+        5: "CLEANING FIRE-POT", 6: "CLEANING FINAL", 7: "ECO-STOP", 8: "?",
+        9: "NO PELLETS", 10: "?", 11: "?", 12: "?", 13: "?", 14: "?", 15: "?",
+        16: "?", 17: "?", 18: "?", 19: "?"
+    }
+
+    job_poll_interval = 1
+    job_poll_retries = 10
+    max_write_workers = 32
+    job_status_workers = 8
+    device_update_workers = 32
+    refresh_workers = 16
+
+    def __init__(self, email, password, unique_id, debug=False,
+                 timings=None, transport=None, min_refresh_interval=0):
+        """evacalor object constructor
+
+        All API calls go through transport, a RequestsTransport unless
+        another Transport is given. Pass a PhaseTimings instance as timings
+        to record how long each phase of the API interaction takes.
+
+        Device updates requested within min_refresh_interval seconds of the
+        last successful update are skipped.
+
+        With debug enabled the pyevacalor and urllib3 loggers are set to
+        DEBUG; configuring handlers is left to the application.
+        """
+        if debug is True:
+            logging.getLogger(__package__).setLevel(logging.DEBUG)
+            _LOGGER.debug("Debug mode is explicitly enabled.")
+
+            requests_logger = logging.getLogger("urllib3")
+            requests_logger.setLevel(logging.DEBUG)
+            requests_logger.propagate = True
+        else:
+            _LOGGER.debug(
+                "Debug mode is not explicitly enabled "
+                "(but may be enabled elsewhere)."
+            )
+
+        self.email = email
+        self.password = password
+        self.unique_id = unique_id
+
+        self.token = None
+        self.token_expires = None
+        self.refresh_token = None
+
+        self.timings = timings
+        self.min_refresh_interval = min_refresh_interval
+        self.transport = transport if transport is not None else RequestsTransport()
+
+        self.devices = list()
+        self._update_listeners = list()
+        self._write_listeners = list()
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._refresher = None
+        self._job_tracker = None
+
+        self._login()
+
+    def _login(self):
+        with self._phase(PHASE_LOGIN):
+            self.register_app_id()
+            self.login()
+        with self._phase(PHASE_DEVICE_LIST):
+            self.fetch_devices()
+        self.fetch_device_information()
+
+    def add_update_listener(self, listener):
+        """Call listener(device) after every successful device update."""
+        self._update_listeners.append(listener)
+
+    def remove_update_listener(self, listener):
+        """Stop calling a listener added with add_update_listener."""
+        self._update_listeners.remove(listener)
+
+    def add_write_listener(self, listener):
+        """Call listener(device, item) after every successful write."""
+        self._write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        """Stop calling a listener added with add_write_listener."""
+        self._write_listeners.remove(listener)
+
+    def _notify_write(self, device, item):
+        for listener in list(self._write_listeners):
+            try:
+                listener(device, item)
+            except Exception:
+                _LOGGER.exception("Error in write listener")
+
+    def _notify_update(self, device):
+        for listener in list(self._update_listeners):
+            try:
+                listener(device)
+            except Exception:
+                _LOGGER.exception("Error in update listener")
+
+    def start_background_refresh(self, ttl, lead=None):
+        """Keep every device's reading younger than ttl seconds from a
+        background thread, so reads never wait for the cloud.
+
+        Refreshes run on their own pool of refresh_workers threads, apart
+        from non-blocking writes. See BackgroundRefresher for lead.
+        """
+        from .refresh import BackgroundRefresher
+
+        self.stop_background_refresh()
+        self._refresher = BackgroundRefresher(
+            self, ttl, lead=lead, workers=self.refresh_workers
+        )
+        self._refresher.start()
+
+    def stop_background_refresh(self):
+        """Stop a refresher started with start_background_refresh."""
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+
+    def _get_job_tracker(self):
+        """Return the JobTracker polling this client's device jobs."""
+        if self._job_tracker is None:
+            with self._executor_lock:
+                if self._job_tracker is None:
+                    self._job_tracker = JobTracker(
+                        self, workers=self.job_status_workers
+                    )
+        return self._job_tracker
+
+    def _get_executor(self):
+        """Return the thread pool running non-blocking writes."""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_write_workers,
+                        thread_name_prefix="pyevacalor-write",
+                    )
+        return self._executor
+
+    def close(self):
+        """Wait for submitted writes and release the transport."""
+        self.stop_background_refresh()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._job_tracker is not None:
+            self._job_tracker.close()
+            self._job_tracker = None
+        self.transport.close()
+
+    def _phase(self, phase):
+        """Return a context manager timing phase when timings are enabled."""
+        if self.timings is None:
+            return nullcontext()
+        return self.timings.measure(phase)
+
+    def _headers(self):
+        """Correctly set headers for requests to Eva Calor."""
+
+        return {'Accept': HEADER_ACCEPT,
+                'Content-Type': HEADER_CONTENT_TYPE,
+                'Origin': 'file://',
+                'id_brand': EVA_COLOR_BRAND_ID,
+                'customer_code': EVA_CALOR_CUSTOMER_CODE}
+
+    def register_app_id(self):
+        """Register app id with Eva Calor"""
+
+        url = API_URL + API_PATH_APP_SIGNUP
+
+        payload = {
+            "phone_type": "Android",
+            "phone_id": self.unique_id,
+            "phone_version": "1.0",
+            "language": "en",
+            "id_app": self.unique_id,
+            "push_notification_token": self.unique_id,
+            "push_notification_active": False
+        }
+        payload = json.dumps(payload)
+
+        response = self.transport.request("POST", url, payload, self._headers())
+
+        if response.status_code != 201:
+            raise UnauthorizedError('Failed to register app id')
+
+        return True
+
+    def login(self):
+        """Authenticate with email and password to Eva Calor"""
+
+        url = API_URL + API_PATH_LOGIN
+
+        payload = {
+            'email': self.email,
+            'password': self.password
+        }
+        payload = json.dumps(payload)
+
+        extra_headers = {
+            'local': 'true',
+            'Authorization': self.unique_id
+        }
+
+        headers = self._headers()
+        headers.update(extra_headers)
+
+        response = self.transport.request("POST", url, payload, headers)
+
+        if response.status_code != 200:
+            raise UnauthorizedError('Failed to login, please check credentials')
+
+        res = response.json()
+        self.token = res['token']
+        self.refresh_token = res['refresh_token']
+
+        claimset = _decode_token(res['token'])
+        self.token_expires = claimset.get('exp')
+
+        return True
+
+    def do_refresh_token(self):
+        """Refresh auth token for Eva Calor"""
+
+        url = API_URL + API_PATH_REFRESH_TOKEN
+
+        payload = {
+            'refresh_token': self.refresh_token
+        }
+        payload = json.dumps(payload)
+
+        response = self.transport.request("POST", url, payload, self._headers())
+
+        if response.status_code != 201:
+            _LOGGER.warning("Refresh auth token failed, forcing new login...")
+            self.login()
+            return
+
+        res = response.json()
+        self.token = res['token']
+
+        claimset = _decode_token(res['token'])
+        self.token_expires = claimset.get('exp')
+
+        return True
+
+    def fetch_devices(self):
+        """Fetch heating devices
+
+        Devices that are already known by id_device are kept, with their
+        name and online state updated in place, so their register maps and
+        readings are preserved. New devices are added and devices that are
+        no longer listed are retired. Returns a DeviceChanges.
+        """
+        url = (API_URL + API_PATH_DEVICE_LIST)
+
+        payload = {}
+        payload = json.dumps(payload)
+
+        res = self.handle_webcall("POST", url, payload)
+        if res is False:
+            raise Error("Error while fetching devices")
+
+        known = dict((device.id_device, device) for device in self.devices)
+        devices = list()
+        added = list()
+        changed = list()
+        for dev in res['device']:
+            device = known.pop(dev['id_device'], None)
+            if device is not None:
+                if device._update_listing(dev['name'], dev['is_online']):
+                    changed.append(device)
+                devices.append(device)
+                continue
+
+            url = (API_URL + API_PATH_DEVICE_INFO)
+
+            payload = {
+                'id_device': dev['id_device'],
+                'id_product': dev['id_product']
+            }
+            payload = json.dumps(payload)
+
+            res2 = self.handle_webcall("POST", url, payload)
+            if res2 is False:
+                raise Error("Error while fetching device info")
+
+            device = Device(
+                dev['id'],
+                dev['id_device'],
+                dev['id_product'],
+                dev['product_serial'],
+                dev['name'],
+                dev['is_online'],
+                dev['name_product'],
+                res2['device_info'][0]['id_registers_map'],
+                self
+            )
+            added.append(device)
+            devices.append(device)
+
+        removed = list(known.values())
+        for device in removed:
+            device._retire()
+
+        self.devices = devices
+        return DeviceChanges(added, removed, changed)
+
+    def fetch_device_information(self):
+        """Fetch device information of Eva Calor heating devices
+
+        Raises the error of the first device that could not be updated,
+        after all devices were tried.
+        """
+        errors = self.update_devices()
+        for device in self.devices:
+            if device in errors:
+                raise errors[device]
+
+    def update_devices(self, devices=None):
+        """Update devices concurrently, by default all of the client's.
+
+        Up to device_update_workers devices are updated at once, their jobs
+        polled together by the client's JobTracker. Returns a dict of the
+        devices that failed to the exception their update raised.
+        """
+        devices = list(self.devices if devices is None else devices)
+        errors = dict()
+
+        def update(device):
+            try:
+                device.update()
+            except Exception as err:
+                errors[device] = err
+
+        if len(devices) <= 1:
+            for device in devices:
+                update(device)
+            return errors
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.device_update_workers, len(devices)),
+            thread_name_prefix="pyevacalor-update",
+        ) as executor:
+            for device in devices:
+                executor.submit(update, device)
+        return errors
+
+    def resync_devices(self):
+        """Pick up added and removed devices without logging in again.
+
+        Only newly added devices are updated; see fetch_devices. A device
+        that fails to update is logged and left without a reading, so the
+        changes are returned either way.
+        """
+        with self._phase(PHASE_DEVICE_LIST):
+            changes = self.fetch_devices()
+        errors = self.update_devices(changes.added)
+        for device, err in errors.items():
+            _LOGGER.warning(
+                "Updating added device %s failed: %s", device.id_device, err,
+                exc_info=None if isinstance(err, Error) else err
+            )
+        return changes
+
+    def track_job(self, id_request, timeout=None, on_status=None,
+                  cancel_event=None):
+        """Register a device job with the client's JobTracker and return
+        its JobHandle; see JobTracker.track.
+        """
+        return self._get_job_tracker().track(
+            id_request,
+            timeout=timeout,
+            on_status=on_status,
+            cancel_event=cancel_event,
+        )
+
+    def wait_job(self, id_request, cancel_event=None, on_status=None):
+        """Wait until a device job completes.
+
+        Returns the last deviceJobStatus response, or False when it could
+        not be fetched or cancel_event was set while waiting. on_status is
+        called with every intermediate jobAnswerStatus. The job is polled
+        by the client's JobTracker, shared with all other outstanding jobs.
+        """
+        handle = self.track_job(
+            id_request, on_status=on_status, cancel_event=cancel_event
+        )
+        try:
+            return handle.result()
+        except CancelledError:
+            return False
+
+    def handle_webcall(self, method, url, payload):
+        response = self._webcall(method, url, payload)
+        if response is False:
+            return False
+
+        return response.json()
+
+    def handle_webcall_stream(self, method, url, payload):
+        """Like handle_webcall, but return the response for reading with
+        iter_content instead of its decoded JSON. The caller must close it.
+        """
+        return self._webcall(method, url, payload, stream=True)
+
+    def _webcall(self, method, url, payload, stream=False):
+        if time.time() > self.token_expires:
+            self.do_refresh_token()
+
+        extra_headers = {
+            'local': 'false',
+            'Authorization': self.token
+        }
+
+        headers = self._headers()
+        headers.update(extra_headers)
+
+        if stream:
+            response = self.transport.request_stream(method, url, payload, headers)
+        else:
+            response = self.transport.request(method, url, payload, headers)
+
+        if response.status_code == 401:
+            response.close()
+            self.do_refresh_token()
+            return self._webcall(method, url, payload, stream)
+        elif response.status_code != 200:
+            response.close()
+            return False
+
+        return response
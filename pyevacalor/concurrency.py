@@ -0,0 +1,72 @@
+"""Concurrency helpers shared by the client and its devices"""
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """Collapses concurrent calls into a single in-flight call.
+
+    The first caller of do runs the function; callers arriving while it is
+    running wait for it and receive the same result or exception.
+    """
+
+    __slots__ = ('_lock', '_future')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._future = None
+
+    def current(self):
+        """Return the Future of the call in flight, or None."""
+        return self._future
+
+    def do(self, func):
+        """Run func unless a call is already in flight, then share its
+        outcome.
+        """
+        future, leader = self._join()
+        if not leader:
+            return future.result()
+        return self._run(func, future)
+
+    def start(self, func):
+        """Return the Future of the call in flight, running func on a new
+        thread when there is none.
+        """
+        future, leader = self._join()
+        if leader:
+            threading.Thread(
+                target=self._run_quietly, args=(func, future),
+                name="pyevacalor-fetch", daemon=True
+            ).start()
+        return future
+
+    def _join(self):
+        with self._lock:
+            future = self._future
+            if future is not None:
+                return future, False
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._future = future
+            return future, True
+
+    def _run(self, func, future):
+        try:
+            result = func()
+        except BaseException as err:
+            with self._lock:
+                self._future = None
+            future.set_exception(err)
+            raise
+        with self._lock:
+            self._future = None
+        future.set_result(result)
+        return result
+
+    def _run_quietly(self, func, future):
+        # The outcome is delivered through future.
+        try:
+            self._run(func, future)
+        except BaseException:
+            pass
@@ -0,0 +1,26 @@
+"""Constants of the Agua IOT API used by Eva Calor devices"""
+
+API_URL = "https://micronova.agua-iot.com"
+API_PATH_APP_SIGNUP = "/appSignup"
+API_PATH_LOGIN = "/userLogin"
+API_PATH_REFRESH_TOKEN = "/refreshToken"
+API_PATH_DEVICE_LIST = "/deviceList"
+API_PATH_DEVICE_INFO = "/deviceGetInfo"
+API_PATH_DEVICE_REGISTERS_MAP = "/deviceGetRegistersMap"
+API_PATH_DEVICE_BUFFER_READING = "/deviceGetBufferReading"
+API_PATH_DEVICE_JOB_STATUS = "/deviceJobStatus/"
+API_PATH_DEVICE_WRITING = "/deviceRequestWriting"
+DEFAULT_TIMEOUT_VALUE = 5
+EVA_CALOR_CUSTOMER_CODE = "635987"
+EVA_COLOR_BRAND_ID = "1"
+
+HEADER_ACCEPT = (
+    "application/json, text/javascript, */*; q=0.01"
+)
+HEADER_CONTENT_TYPE = (
+    "application/json"
+)
+HEADER = {
+    'Accept': HEADER_ACCEPT,
+    'Content-Type': HEADER_CONTENT_TYPE
+}
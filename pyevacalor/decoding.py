@@ -0,0 +1,446 @@
+"""Decoding and encoding of Eva Calor register values
+
+Register maps and buffer layouts are interned: every device using the
+same registers map shares one immutable RegisterMap, and every reading
+with the same Items shares one BufferLayout, so a large fleet only pays
+for them once.
+"""
+import codecs
+import json
+import re
+import sys
+import threading
+import weakref
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+
+Register = namedtuple('Register', [
+    'reg_type', 'offset', 'formula', 'formula_inverse', 'format_string',
+    'set_min', 'set_max', 'mask', 'value_on', 'value_off'
+])
+Register.__new__.__defaults__ = (None, None)
+
+_intern_lock = threading.Lock()
+_register_maps = weakref.WeakValueDictionary()
+_buffer_layouts = weakref.WeakValueDictionary()
+
+
+def _intern_string(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class RegisterMap(Mapping):
+    """Immutable mapping of register keys to Register records"""
+
+    __slots__ = ('key', '_registers', '__weakref__')
+
+    def __init__(self, key, registers):
+        self.key = key
+        self._registers = registers
+
+    def __getitem__(self, reg_key):
+        return self._registers[reg_key]
+
+    def __iter__(self):
+        return iter(self._registers)
+
+    def __len__(self):
+        return len(self._registers)
+
+    def __contains__(self, reg_key):
+        return reg_key in self._registers
+
+    def __repr__(self):
+        return str.format(
+            "<RegisterMap {0!r} with {1} registers>", self.key, len(self)
+        )
+
+
+EMPTY_REGISTER_MAP = RegisterMap(None, dict())
+
+
+def intern_register_map(key, registers):
+    """Return the shared RegisterMap for key, creating it when the
+    registers differ from the one currently shared.
+    """
+    with _intern_lock:
+        register_map = _register_maps.get(key)
+        if register_map is None or register_map._registers != registers:
+            register_map = RegisterMap(key, registers)
+            _register_maps[key] = register_map
+        return register_map
+
+
+def _build_registers(registers_map):
+    """Return the Register records of one registers_map entry by key."""
+    registers = dict()
+    for register in registers_map['registers']:
+        value_on = None
+        value_off = None
+        if 'enc_val' in register:
+            for v in register['enc_val']:
+                if v['lang'] == "ENG" and v['description'] == 'ON':
+                    value_on = v['value']
+                elif v['lang'] == "ENG" and v['description'] == 'OFF':
+                    value_off = v['value']
+        registers[sys.intern(register['reg_key'])] = Register(
+            _intern_string(register['reg_type']),
+            register['offset'],
+            _intern_string(register['formula']),
+            _intern_string(register['formula_inverse']),
+            _intern_string(register['format_string']),
+            register['set_min'],
+            register['set_max'],
+            register['mask'],
+            value_on,
+            value_off,
+        )
+    return registers
+
+
+def parse_registers_map(res, id_product, id_registers_map):
+    """Build the shared RegisterMap for id_registers_map from a
+    deviceGetRegistersMap response, or return None when it is missing.
+    """
+    registers = None
+    for registers_map in res['device_registers_map']['registers_map']:
+        if registers_map['id'] == id_registers_map:
+            registers = _build_registers(registers_map)
+    if registers is None:
+        return None
+    return intern_register_map((id_product, id_registers_map), registers)
+
+
+def parse_registers_map_stream(chunks, id_product, id_registers_map):
+    """Like parse_registers_map, reading the response incrementally from
+    an iterable of UTF-8 byte chunks.
+
+    Maps with another id are scanned past without being decoded and
+    reading stops after the matching map, so only that map is ever held
+    in memory. Raises ValueError on a malformed or truncated response.
+    """
+    reader = _ChunkReader(chunks)
+    for map_id, text in _scan_registers_maps(reader, id_registers_map):
+        if text is None:
+            continue
+        registers_map = json.loads(text)
+        if registers_map['id'] == id_registers_map:
+            return intern_register_map(
+                (id_product, id_registers_map),
+                _build_registers(registers_map)
+            )
+    return None
+
+
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+
+
+def _compile_scanners(string):
+    """Return the (no_brackets, no_nesting) scanners for a string pattern.
+
+    no_brackets matches a run of anything but brackets, with strings
+    consumed whole, and stops at a bracket or at a string that is not
+    complete yet. no_nesting also consumes objects and arrays holding no
+    nested ones, so only the brackets of containers with nested values are
+    left to Python. Both are unrolled so every text matches one way only
+    and a failed match cannot backtrack exponentially.
+    """
+    plain = r'[^"\[\]{}]*'
+    flat = plain + r'(?:' + string + plain + r')*'
+    leaf = r'(?:\{' + flat + r'\}|\[' + flat + r'\])'
+    return (
+        re.compile(flat),
+        re.compile(flat + r'(?:' + leaf + flat + r')*'),
+    )
+
+
+# Strings without escape sequences match about twice as fast, so the
+# escape-aware scanners are only used once a backslash was read.
+_SCANNERS = _compile_scanners(r'"[^"]*"')
+_ESCAPED_SCANNERS = _compile_scanners(_STRING)
+_ELEMENT_GAP = re.compile(r'[\s,]*')
+_MAP_ID = re.compile(
+    r'[{,]\s*"id"\s*:\s*(-?\d+|' + _STRING + r')'
+)
+# Keys leading to the registers_map array, each matched against the text
+# between its object's brackets up to the bracket opening its value.
+_REGISTERS_MAP_PATH = (
+    re.compile(r'[{,]\s*"device_registers_map"\s*:\s*\Z'),
+    re.compile(r'[{,]\s*"registers_map"\s*:\s*\Z'),
+)
+
+
+class _ChunkReader(object):
+    """Text buffer filled from an iterable of UTF-8 byte chunks"""
+
+    __slots__ = ('_chunks', '_decoder', 'text', 'escaped')
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.escaped = False
+
+    def more(self):
+        """Append the next chunk, returning False at the end of the
+        stream.
+        """
+        for chunk in self._chunks:
+            if chunk:
+                self._append(self._decoder.decode(chunk))
+                return True
+        tail = self._decoder.decode(b"", True)
+        self._append(tail)
+        return bool(tail)
+
+    def _append(self, text):
+        if not self.escaped and "\\" in text:
+            self.escaped = True
+        self.text += text
+
+    def drop(self, position):
+        """Forget the text before position."""
+        self.text = self.text[position:]
+
+
+def _scan_registers_maps(reader, id_registers_map):
+    """Yield (id, text) for every entry of the registers_map array.
+
+    text is the raw JSON of the entry when its id is id_registers_map or
+    could not be read cheaply, and None for entries that were skipped.
+    """
+    if not _seek_registers_map_array(reader):
+        return
+
+    while True:
+        position = _ELEMENT_GAP.match(reader.text).end()
+        if position == len(reader.text):
+            reader.drop(position)
+            if not reader.more():
+                raise ValueError("Truncated registers map response")
+            continue
+        char = reader.text[position]
+        if char == "]":
+            return
+        if char != "{":
+            raise ValueError("Malformed registers map response")
+        reader.drop(position)
+        yield _scan_registers_map(reader, id_registers_map)
+
+
+def _seek_registers_map_array(reader):
+    """Drop the buffer up to the opening bracket of the
+    device_registers_map.registers_map array, returning False when the
+    response has none.
+    """
+    matched = 0
+    depth = 0
+    position = 0
+    # Start of the text between brackets at the level of the next key.
+    segment = 0
+    while True:
+        text = reader.text
+        scanners = _ESCAPED_SCANNERS if reader.escaped else _SCANNERS
+        level = depth == matched + 1
+        scanner = scanners[0] if depth <= matched + 1 else scanners[1]
+        position = scanner.match(text, position).end()
+        if position == len(text) or text[position] == '"':
+            keep = segment if level else position
+            reader.drop(keep)
+            position -= keep
+            segment -= keep
+            if not reader.more():
+                return False
+            continue
+
+        char = text[position]
+        if char in "{[":
+            if level and _REGISTERS_MAP_PATH[matched].search(
+                    text, segment, position):
+                if matched == len(_REGISTERS_MAP_PATH) - 1:
+                    if char == "[":
+                        reader.drop(position + 1)
+                        return True
+                elif char == "{":
+                    matched += 1
+            depth += 1
+        else:
+            depth -= 1
+            # The object holding the next key ended without it.
+            if depth <= matched:
+                return False
+        segment = position
+        position += 1
+
+
+def _scan_registers_map(reader, id_registers_map):
+    """Scan the object at the start of the buffer, returning (id, text)
+    and dropping it from the buffer.
+    """
+    depth = 0
+    position = 0
+    # Start of the text between nested values, where the entry's own keys
+    # such as "id" are found.
+    segment = 0
+    map_id = None
+    keep = True
+    while True:
+        text = reader.text
+        # The entry's own keys are scanned bracket by bracket so "id" is
+        # only looked for at its top level.
+        scanners = _ESCAPED_SCANNERS if reader.escaped else _SCANNERS
+        scanner = scanners[0] if depth <= 1 else scanners[1]
+        position = scanner.match(text, position).end()
+        if position == len(text) or text[position] == '"':
+            if not keep:
+                reader.drop(position)
+                position = 0
+            if not reader.more():
+                raise ValueError("Truncated registers map response")
+            continue
+
+        char = text[position]
+        if char in "{[":
+            if depth == 1 and map_id is None:
+                map_id = _find_map_id(text, segment, position)
+                keep = map_id is None or map_id == id_registers_map
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                end = position + 1
+                if map_id is None:
+                    map_id = _find_map_id(text, segment, end)
+                    keep = map_id is None or map_id == id_registers_map
+                result = (map_id, text[:end] if keep else None)
+                reader.drop(end)
+                return result
+            if depth == 1:
+                segment = position
+        position += 1
+
+
+def _find_map_id(text, start, end):
+    match = _MAP_ID.search(text, start, end)
+    if match is None:
+        return None
+    return json.loads(match.group(1))
+
+
+class BufferLayout(object):
+    """Register offsets of a buffer reading and their positions"""
+
+    __slots__ = ('items', 'positions', '__weakref__')
+
+    def __init__(self, items):
+        self.items = items
+        self.positions = dict(
+            (item, position) for position, item in enumerate(items)
+        )
+
+
+def intern_buffer_layout(items):
+    """Return the shared BufferLayout for a tuple of register offsets."""
+    with _intern_lock:
+        layout = _buffer_layouts.get(items)
+        if layout is None:
+            layout = BufferLayout(items)
+            _buffer_layouts[items] = layout
+        return layout
+
+
+class BufferReading(object):
+    """Raw register values of a buffer reading, indexed by offset"""
+
+    __slots__ = ('layout', 'values')
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+
+    def __getitem__(self, offset):
+        return self.values[self.layout.positions[offset]]
+
+    def __contains__(self, offset):
+        return offset in self.layout.positions
+
+    def __len__(self):
+        return len(self.layout.items)
+
+    def keys(self):
+        return self.layout.items
+
+    def replace(self, offset, value, mask=None):
+        """Return a copy with the register at offset set to value, only
+        changing the bits in mask when one is given.
+        """
+        position = self.layout.positions[offset]
+        values = list(self.values)
+        if mask and isinstance(values[position], int):
+            value = (values[position] & ~mask) | (value & mask)
+        values[position] = value
+        return BufferReading(self.layout, _compact_values(values))
+
+
+EMPTY_READING = BufferReading(intern_buffer_layout(()), ())
+
+
+def _compact_values(values):
+    try:
+        return array('i', values)
+    except (TypeError, OverflowError):
+        return tuple(values)
+
+
+def parse_buffer_reading(job_answer_data):
+    """Build a BufferReading from the Items and Values of a completed
+    buffer reading job.
+
+    Raises KeyError when the job answer holds no items.
+    """
+    items = tuple(job_answer_data['Items'])
+    values = job_answer_data['Values']
+    if len(values) < len(items):
+        raise KeyError('Values')
+    layout = intern_buffer_layout(items)
+    return BufferReading(layout, _compact_values(values[:len(items)]))
+
+
+def decode_item(register_map, reading, item):
+    """Apply the formula and format string of item to its raw value."""
+    register = register_map[item]
+    formula = register.formula.replace(
+        "#",
+        str(reading[register.offset])
+    )
+    return str.format(
+        register.format_string,
+        eval(formula)
+    )
+
+
+def encode_value(register_map, item, value):
+    """Return the raw values to write to set item to value."""
+    value = float(value)
+    register = register_map[item]
+    set_min = register.set_min
+    set_max = register.set_max
+
+    if value < set_min or value > set_max:
+        raise ValueError(
+            "Value must be between {0} and {1}".format(
+                set_min, set_max
+            )
+        )
+
+    formula = register.formula_inverse.replace(
+        "#",
+        str(value)
+    )
+    return [int(float(str.format(
+        register.format_string,
+        eval(formula)
+    )))]
@@ -0,0 +1,562 @@
+"""Eva Calor heating device"""
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+from .const import (
+    API_PATH_DEVICE_BUFFER_READING,
+    API_PATH_DEVICE_REGISTERS_MAP,
+    API_PATH_DEVICE_WRITING,
+    API_URL,
+)
+from .decoding import (
+    EMPTY_READING,
+    EMPTY_REGISTER_MAP,
+    decode_item,
+    encode_value,
+    parse_buffer_reading,
+    parse_registers_map_stream,
+)
+from .concurrency import SingleFlight
+from .exceptions import Error
+from .jobs import (
+    JOB_STATE_COMPLETED,
+    JOB_STATE_FAILED,
+    JOB_STATE_WAITING,
+    WriteFuture,
+)
+from .timings import PHASE_BUFFER_READ, PHASE_JOB_WAIT, PHASE_REGISTER_MAP
+
+_LOGGER = logging.getLogger(__name__)
+
+_NUMBERS = re.compile(r'\d+(?:\.\d+)?')
+
+SNAPSHOT_ATTRIBUTES = (
+    'status', 'status_translated', 'status_managed', 'alarms',
+    'air_temperature', 'set_air_temperature', 'gas_temperature',
+    'real_power', 'set_power', 'min_temp', 'max_temp',
+)
+
+
+class Device(object):
+    """Eva Calor heating device representation"""
+
+    __slots__ = (
+        '__id', '__id_device', '__id_product', '__product_serial', '__name',
+        '__is_online', '__name_product', '__id_registers_map', '__evacalor',
+        '__register_map', '__reading', '__view', '__last_update', '__flight',
+        '__pending', '__state_lock', '__retired', '__read_started',
+        '__weakref__',
+    )
+
+    def __init__(self, id, id_device, id_product, product_serial, name,
+                 is_online, name_product, id_registers_map, evacalor):
+        self.__id = id
+        self.__id_device = id_device
+        self.__id_product = id_product
+        self.__product_serial = product_serial
+        self.__name = name
+        self.__is_online = is_online
+        self.__name_product = name_product
+        self.__id_registers_map = id_registers_map
+        self.__evacalor = evacalor
+        self.__register_map = EMPTY_REGISTER_MAP
+        self.__reading = EMPTY_READING
+        self.__view = EMPTY_READING
+        self.__last_update = None
+        self.__flight = SingleFlight()
+        self.__pending = dict()
+        self.__state_lock = threading.Lock()
+        self.__retired = False
+        self.__read_started = None
+
+    def update(self):
+        """Update device information
+
+        Concurrent calls on the same device share a single fetch. The
+        update is skipped when the last one completed less than the
+        client's min_refresh_interval seconds ago.
+        """
+        if self.__is_fresh():
+            return
+        self.__flight.do(self.__fetch)
+
+    async def async_update(self):
+        """Update device information from a coroutine
+
+        Shares the fetch in flight with other async and threaded callers,
+        running a new one in the event loop's default executor otherwise.
+        """
+        import asyncio
+
+        if self.__is_fresh():
+            return
+        future = self.__flight.current()
+        if future is None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.__flight.do, self.__fetch)
+        else:
+            await asyncio.shield(asyncio.wrap_future(future))
+
+    def _refresh(self, since=None):
+        """Fetch a new reading regardless of min_refresh_interval, sharing
+        a fetch in flight.
+
+        With since, a time.monotonic() value, fetch again until the reading
+        was requested at or after since.
+        """
+        self.__flight.do(self.__fetch)
+        while since is not None and self.__read_started < since:
+            self.__flight.do(self.__fetch)
+
+    def wait_fresh(self, timeout=None):
+        """Wait for a reading requested after this call.
+
+        Returns True once it is available and False when timeout seconds
+        passed first. Raises Error when the reading could not be fetched.
+        """
+        since = time.monotonic()
+        deadline = None if timeout is None else since + timeout
+        while self.__read_started is None or self.__read_started < since:
+            # Wait on the fetch in flight, starting one when there is none;
+            # a fetch requested before this call is followed by another.
+            future = self.__flight.start(self.__fetch)
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            try:
+                future.result(remaining)
+            except TimeoutError:
+                return False
+        return True
+
+    def __is_fresh(self):
+        interval = self.__evacalor.min_refresh_interval
+        return (interval and self.__last_update is not None
+                and time.time() - self.__last_update < interval)
+
+    def __fetch(self):
+        started = time.monotonic()
+        with self.__evacalor._phase(PHASE_REGISTER_MAP):
+            self.__update_device_registers_mapping()
+        reading = self.__update_device_information()
+
+        with self.__state_lock:
+            # Writes completed after this reading was requested are not
+            # reflected in it yet, so they stay pending.
+            pending = dict(
+                (item, write) for item, write in self.__pending.items()
+                if write[1] > started
+            )
+            view = reading
+            for item, write in pending.items():
+                view = self.__apply_value(view, item, write[0])
+            self.__reading = reading
+            self.__view = view
+            self.__pending = pending
+            self.__last_update = time.time()
+            self.__read_started = started
+        self.__evacalor._notify_update(self)
+
+    def __apply_value(self, reading, item, values):
+        register = self.__register_map[item]
+        if register.offset not in reading:
+            return reading
+        return reading.replace(register.offset, values[0], register.mask)
+
+    def __store_written(self, item, values):
+        """Reflect a successful write in the decoded values until the next
+        real reading confirms it. The fetched reading is left untouched.
+        """
+        with self.__state_lock:
+            self.__view = self.__apply_value(self.__view, item, values)
+            self.__pending[item] = (values, time.monotonic())
+        self.__evacalor._notify_write(self, item)
+
+    @property
+    def pending_items(self):
+        """Register keys written but not yet confirmed by a reading"""
+        return sorted(self.__pending)
+
+    def is_pending(self, item):
+        """Return True when item was written but not yet read back."""
+        return item in self.__pending
+
+    def _update_listing(self, name, is_online):
+        """Apply the deviceList fields that can change, returning True
+        when one of them did.
+        """
+        changed = name != self.__name or is_online != self.__is_online
+        self.__name = name
+        self.__is_online = is_online
+        return changed
+
+    def _retire(self):
+        self.__retired = True
+
+    def get_snapshot(self):
+        """Return the decoded values of the last reading as a dict.
+
+        Values that are not available for this device are set to None.
+        """
+        snapshot = {
+            'id_device': self.__id_device,
+            'id_product': self.__id_product,
+            'name': self.__name,
+            'name_product': self.__name_product,
+            'is_online': self.__is_online,
+            'last_update': self.__last_update,
+            'pending': self.pending_items,
+        }
+        for attr in SNAPSHOT_ATTRIBUTES:
+            try:
+                snapshot[attr] = getattr(self, attr)
+            except (KeyError, IndexError, ValueError, TypeError):
+                snapshot[attr] = None
+        return snapshot
+
+    def __update_device_registers_mapping(self):
+        url = (API_URL + API_PATH_DEVICE_REGISTERS_MAP)
+
+        payload = {
+                'id_device': self.__id_device,
+                'id_product': self.__id_product,
+                'last_update': '2018-06-03T08:59:54.043'
+        }
+        payload = json.dumps(payload)
+
+        response = self.__evacalor.handle_webcall_stream("POST", url, payload)
+        if response is False:
+            _LOGGER.debug("GETREGISTERSMAP CALL FAILED!")
+            raise Error("Error while fetching registers map")
+
+        try:
+            register_map = parse_registers_map_stream(
+                response.iter_content(),
+                self.__id_product,
+                self.__id_registers_map
+            )
+        except ValueError:
+            _LOGGER.debug("GETREGISTERSMAP RESPONSE INVALID!")
+            raise Error("Error while fetching registers map")
+        finally:
+            response.close()
+        if register_map is not None:
+            _LOGGER.debug("SUCCESSFULLY UPDATED REGISTERS MAP!")
+            self.__register_map = register_map
+
+    def __update_device_information(self):
+        url = (API_URL + API_PATH_DEVICE_BUFFER_READING)
+
+        payload = {
+                'id_device': self.__id_device,
+                'id_product': self.__id_product,
+                'BufferId': 1
+        }
+        payload = json.dumps(payload)
+
+        with self.__evacalor._phase(PHASE_BUFFER_READ):
+            res = self.__evacalor.handle_webcall("POST", url, payload)
+        if res is False:
+            _LOGGER.debug("GETBUFFERREADING CALL FAILED!")
+            raise Error("Error while fetching device information")
+
+        _LOGGER.debug("GETBUFFERREADING SUCCEEDED!")
+
+        id_request = res['idRequest']
+
+        with self.__evacalor._phase(PHASE_JOB_WAIT):
+            res = self.__evacalor.wait_job(id_request)
+
+        if res is False or res['jobAnswerStatus'] != "completed":
+            _LOGGER.debug("JOBANSWERSTATUS NOT COMPLETED!")
+            raise Error("Error while fetching device information")
+
+        _LOGGER.debug("JOBANSWERSTATUS COMPLETED!")
+
+        try:
+            reading = parse_buffer_reading(res['jobAnswerData'])
+        except KeyError:
+            _LOGGER.debug("NO ITEMS IN JOBANSWERDATA!")
+            raise Error("Error while fetching device information")
+
+        _LOGGER.debug("SUCCESSFULLY RETRIEVED ITEM IN JOBANSWERDATA!")
+
+        return reading
+
+    def __get_information_item(self, item):
+        return decode_item(self.__register_map, self.__view, item)
+
+    def __get_information_item_min(self, item):
+        return int(self.__register_map[item].set_min)
+
+    def __get_information_item_max(self, item):
+        return int(self.__register_map[item].set_max)
+
+    def __prepare_value_for_writing(self, item, value):
+        return encode_value(self.__register_map, item, value)
+
+    def __start_writing(self, item, values):
+        """Request a write and return the idRequest of its job."""
+        url = (API_URL + API_PATH_DEVICE_WRITING)
+
+        items = [int(self.__register_map[item].offset)]
+        masks = [int(self.__register_map[item].mask)]
+
+        payload = {
+                'id_device': self.__id_device,
+                'id_product': self.__id_product,
+                "Protocol": "RWMSmaster",
+                "BitData": [8],
+                "Endianess": ["L"],
+                "Items": items,
+                "Masks": masks,
+                "Values": values
+        }
+        payload = json.dumps(payload)
+
+        res = self.__evacalor.handle_webcall("POST", url, payload)
+        if res is False:
+            raise Error("Error while request device writing")
+
+        return res['idRequest']
+
+    def __finish_writing(self, item, values, res):
+        """Check the final job status of a write and reflect it in the
+        cached reading.
+        """
+        if res is False or res['jobAnswerStatus'] != "completed" or 'Cmd' not in res['jobAnswerData']:
+            raise Error("Error while request device writing")
+
+        self.__store_written(item, values)
+        return res['jobAnswerData']
+
+    def __request_writing(self, item, values):
+        id_request = self.__start_writing(item, values)
+        res = self.__evacalor.wait_job(id_request)
+        return self.__finish_writing(item, values, res)
+
+    def __submit_writing(self, item, values, message):
+        """Start a write and return its WriteFuture.
+
+        Only the deviceRequestWriting call runs on the client's thread
+        pool; the job is then left to the client's JobTracker, so no thread
+        waits for it.
+        """
+        future = WriteFuture(self, item)
+
+        def fail(err):
+            if future.set_running_or_notify_cancel():
+                future.state = JOB_STATE_FAILED
+                future.set_exception(
+                    Error(message) if isinstance(err, Error) else err
+                )
+
+        def finish(handle):
+            if handle.cancelled():
+                future.cancel()
+                return
+            try:
+                result = self.__finish_writing(item, values, handle.result())
+            except Exception as err:
+                fail(err)
+                return
+            if future.set_running_or_notify_cancel():
+                future.state = JOB_STATE_COMPLETED
+                future.set_result(result)
+
+        def run():
+            if future.cancelled():
+                return
+            try:
+                future.id_request = self.__start_writing(item, values)
+                future.state = JOB_STATE_WAITING
+                handle = self.__evacalor.track_job(
+                    future.id_request,
+                    on_status=lambda status: setattr(future, 'state', status),
+                    cancel_event=future.cancel_event,
+                )
+            except Exception as err:
+                fail(err)
+                return
+            future.add_done_callback(
+                lambda _: handle.cancel() if future.cancelled() else None
+            )
+            handle.add_done_callback(finish)
+
+        self.__evacalor._get_executor().submit(run)
+        return future
+
+    def submit_air_temperature(self, value):
+        """Start setting the air temperature and return a WriteFuture."""
+        item = 'temp_air_set'
+        values = self.__prepare_value_for_writing(item, value)
+        return self.__submit_writing(
+            item, values, "Error while trying to set temperature"
+        )
+
+    def submit_power(self, value):
+        """Start setting the power and return a WriteFuture."""
+        item = 'power_set'
+        values = self.__prepare_value_for_writing(item, value)
+        return self.__submit_writing(
+            item, values, "Error while trying to set power"
+        )
+
+    def submit_turn_off(self):
+        """Start turning the device off and return a WriteFuture."""
+        item = 'status_managed_get'
+        values = [int(self.__register_map[item].value_off)]
+        return self.__submit_writing(
+            item, values, "Error while trying to turn off device"
+        )
+
+    def submit_turn_on(self):
+        """Start turning the device on and return a WriteFuture."""
+        item = 'status_managed_get'
+        values = [int(self.__register_map[item].value_on)]
+        return self.__submit_writing(
+            item, values, "Error while trying to turn on device"
+        )
+
+    @property
+    def id(self):
+        return self.__id
+
+    @property
+    def id_device(self):
+        return self.__id_device
+
+    @property
+    def id_product(self):
+        return self.__id_product
+
+    @property
+    def product_serial(self):
+        return self.__product_serial
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def is_online(self):
+        return self.__is_online
+
+    @property
+    def name_product(self):
+        return self.__name_product
+
+    @property
+    def id_registers_map(self):
+        return self.__id_registers_map
+
+    @property
+    def retired(self):
+        """True once the device is no longer listed for the account"""
+        return self.__retired
+
+    @property
+    def last_update(self):
+        return self.__last_update
+
+    @property
+    def buffer_items(self):
+        """Register offsets of the last buffer reading, in reading order"""
+        return list(self.__reading.layout.items)
+
+    @property
+    def buffer_values(self):
+        """Raw register values of the last buffer reading, without writes
+        that no reading has confirmed yet
+        """
+        return list(self.__reading.values)
+
+    @property
+    def status_managed(self):
+        return int(self.__get_information_item('status_managed_get'))
+
+    @property
+    def status_managed_enable(self):
+        return int(self.__get_information_item('status_managed_on_enable'))
+
+    @property
+    def status(self):
+        return int(self.__get_information_item('status_get'))
+
+    @property
+    def status_translated(self):
+        return self.__evacalor.statusTranslated[
+            int(self.__get_information_item('status_get'))
+        ]
+
+    @property
+    def alarms(self):
+        return self.__get_information_item('alarms_get')
+
+    @property
+    def min_temp(self):
+        return self.__get_information_item_min('temp_air_set')
+
+    @property
+    def max_temp(self):
+        return self.__get_information_item_max('temp_air_set')
+
+    @property
+    def air_temperature(self):
+        return float(_NUMBERS.findall(self.__get_information_item('temp_air_get'))[0])
+
+    @property
+    def set_air_temperature(self):
+        return float(self.__get_information_item('temp_air_set'))
+
+    @set_air_temperature.setter
+    def set_air_temperature(self, value):
+        item = 'temp_air_set'
+        values = self.__prepare_value_for_writing(item, value)
+        try:
+            self.__request_writing(item, values)
+        except Error:
+            raise Error("Error while trying to set temperature")
+
+    @property
+    def gas_temperature(self):
+        return float(_NUMBERS.findall(self.__get_information_item('temp_gas_flue_get'))[0])
+
+    @property
+    def real_power(self):
+        return int(self.__get_information_item('real_power_get'))
+
+    @property
+    def set_power(self):
+        return int(self.__get_information_item('power_set'))
+
+    @set_power.setter
+    def set_power(self, value):
+        item = 'power_set'
+        values = self.__prepare_value_for_writing(item, value)
+        try:
+            self.__request_writing(item, values)
+        except Error:
+            raise Error("Error while trying to set power")
+
+    def turn_off(self):
+        item = 'status_managed_get'
+        values = [int(self.__register_map[item].value_off)]
+        try:
+            self.__request_writing(item, values)
+        except Error:
+            raise Error("Error while trying to turn off device")
+
+    def turn_on(self):
+        item = 'status_managed_get'
+        values = [int(self.__register_map[item].value_on)]
+        try:
+            self.__request_writing(item, values)
+        except Error:
+            raise Error("Error while trying to turn on device")
@@ -0,0 +1,19 @@
+"""Exceptions raised by pyevacalor"""
+
+
+class Error(Exception):
+    """Exception type for Eva Calor"""
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+class UnauthorizedError(Error):
+    """Unauthorized"""
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class ConnectionError(Error):
+    """Unauthorized"""
+    def __init__(self, message):
+        super().__init__(message)
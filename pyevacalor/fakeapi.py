@@ -0,0 +1,303 @@
+"""In-process fake of the Agua IOT API for load tests and benchmarks
+
+FakeAguaApi is a Transport simulating any number of accounts with any
+number of stoves each. Register maps have the shape of real
+deviceGetRegistersMap responses (several maps per product, hundreds of
+registers, enc_val descriptions in several languages), jobs complete after
+a configurable latency and a configurable share of requests fail.
+"""
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .const import (
+    API_PATH_APP_SIGNUP,
+    API_PATH_DEVICE_BUFFER_READING,
+    API_PATH_DEVICE_INFO,
+    API_PATH_DEVICE_JOB_STATUS,
+    API_PATH_DEVICE_LIST,
+    API_PATH_DEVICE_REGISTERS_MAP,
+    API_PATH_DEVICE_WRITING,
+    API_PATH_LOGIN,
+    API_PATH_REFRESH_TOKEN,
+)
+from .transport import Response, Transport, make_token
+
+LANGUAGES = ("ENG", "ITA", "FRA", "DEU", "ESP", "NLD")
+
+PRODUCT_ID = "EVA-CALOR-FAKE"
+
+STATUS_OFFSET = 33
+TEMP_AIR_OFFSET = 1025
+TEMP_GAS_OFFSET = 1026
+ALARMS_OFFSET = 1800
+
+KNOWN_REGISTERS = (
+    ('status_get', STATUS_OFFSET, "#", "#", "{0:.0f}", 0, 20),
+    ('status_managed_get', 1792, "#", "#", "{0:.0f}", 0, 1),
+    ('status_managed_on_enable', 1793, "#", "#", "{0:.0f}", 0, 1),
+    ('alarms_get', ALARMS_OFFSET, "#", "#", "{0:.0f}", 0, 255),
+    ('temp_air_get', TEMP_AIR_OFFSET, "#/2", "#*2", "{0:.1f}", 0, 100),
+    ('temp_air_set', 1101, "#/2", "#*2", "{0:.1f}", 10, 30),
+    ('temp_gas_flue_get', TEMP_GAS_OFFSET, "#", "#", "{0:.0f}", 0, 500),
+    ('real_power_get', 1030, "#", "#", "{0:.0f}", 0, 5),
+    ('power_set', 1102, "#", "#", "{0:.0f}", 1, 5),
+)
+
+# Stale jobs nobody polled anymore are dropped after this many seconds.
+JOB_EXPIRY = 300
+
+
+def _enc_val(values):
+    return [
+        {
+            'lang': lang,
+            'description': description if description is not None
+            else str.format("{0} {1}", lang, value),
+            'value': value,
+        }
+        for value, description in values
+        for lang in LANGUAGES
+    ]
+
+
+def make_registers_map(map_id, registers=120, seed=0):
+    """Return one entry of registers_map as found in the API response."""
+    rnd = random.Random(seed + map_id)
+    entries = list()
+    for reg_key, offset, formula, inverse, fmt, set_min, set_max in KNOWN_REGISTERS:
+        entry = {
+            'reg_key': reg_key, 'reg_type': "DATA", 'offset': offset,
+            'formula': formula, 'formula_inverse': inverse,
+            'format_string': fmt, 'set_min': set_min, 'set_max': set_max,
+            'mask': 65535,
+        }
+        if reg_key == 'status_managed_get':
+            entry['enc_val'] = _enc_val([(0, 'OFF'), (1, 'ON')])
+        entries.append(entry)
+
+    for index in range(max(0, registers - len(KNOWN_REGISTERS))):
+        entry = {
+            'reg_key': str.format("reg_{0}", index), 'reg_type': "DATA",
+            'offset': 2000 + index, 'formula': "#/10",
+            'formula_inverse': "#*10", 'format_string': "{0:.1f}",
+            'set_min': 0, 'set_max': rnd.randint(10, 1000), 'mask': 65535,
+        }
+        if rnd.random() < 0.2:
+            entry['enc_val'] = _enc_val(
+                [(value, None) for value in range(rnd.randint(2, 6))]
+            )
+        entries.append(entry)
+    return {'id': map_id, 'registers': entries}
+
+
+def make_registers_map_response(map_ids=(1, 2, 3, 4, 5), registers=120):
+    """Return a deviceGetRegistersMap response holding several maps."""
+    return {
+        'device_registers_map': {
+            'registers_map': [
+                make_registers_map(map_id, registers) for map_id in map_ids
+            ]
+        }
+    }
+
+
+class _Stove(object):
+    """Simulated register state of a single stove"""
+
+    __slots__ = ('listing', 'values')
+
+    def __init__(self, listing, items, rnd):
+        self.listing = listing
+        self.values = dict((item, rnd.randint(0, 400)) for item in items)
+        self.values[STATUS_OFFSET] = rnd.choice((0, 0, 1, 4, 4, 4))
+        self.values[TEMP_AIR_OFFSET] = rnd.randint(30, 50)
+        self.values[ALARMS_OFFSET] = 0
+
+    def tick(self, rnd):
+        self.values[TEMP_AIR_OFFSET] = max(
+            0, self.values[TEMP_AIR_OFFSET] + rnd.randint(-1, 1)
+        )
+        self.values[TEMP_GAS_OFFSET] = max(
+            0, self.values[TEMP_GAS_OFFSET] + rnd.randint(-5, 5)
+        )
+
+
+class FakeAguaApi(Transport):
+    """Transport answering all Agua IOT API calls from memory
+
+    Accounts are named user<N>@example.com and accept any password. Jobs
+    report "pending" until job_latency seconds after they were requested.
+    A share of error_rate of all non-authentication requests answers with
+    HTTP 500, and every request takes request_latency seconds.
+    """
+
+    def __init__(self, accounts=1, devices_per_account=1, registers=120,
+                 id_registers_map=3, job_latency=0.0, error_rate=0.0,
+                 request_latency=0.0, seed=0):
+        self.job_latency = job_latency
+        self.error_rate = error_rate
+        self.request_latency = request_latency
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._tokens = dict()
+        self._token_counter = 0
+        self._jobs = dict()
+        self._job_counter = 0
+        self._last_expiry = time.monotonic()
+
+        registers_map_response = make_registers_map_response(
+            registers=registers
+        )
+        self._registers_map_body = json.dumps(
+            registers_map_response
+        ).encode("utf-8")
+        registers_map = next(
+            entry for entry in
+            registers_map_response['device_registers_map']['registers_map']
+            if entry['id'] == id_registers_map
+        )
+        self._items = sorted(
+            set(entry['offset'] for entry in registers_map['registers'])
+        )
+        self._device_info_body = json.dumps(
+            {'device_info': [{'id_registers_map': id_registers_map}]}
+        ).encode("utf-8")
+
+        self.accounts = dict()
+        self._stoves = dict()
+        for account in range(accounts):
+            email = self.account_email(account)
+            listings = list()
+            for index in range(devices_per_account):
+                number = account * devices_per_account + index
+                listing = {
+                    'id': number,
+                    'id_device': str.format("DEV{0:08d}", number),
+                    'id_product': PRODUCT_ID,
+                    'product_serial': str.format("SN{0:08d}", number),
+                    'name': str.format("Stove {0}", number),
+                    'is_online': True,
+                    'name_product': "Eva Calor",
+                }
+                listings.append(listing)
+                self._stoves[listing['id_device']] = _Stove(
+                    listing, self._items, self._random
+                )
+            self.accounts[email] = listings
+
+    @staticmethod
+    def account_email(index):
+        return str.format("user{0}@example.com", index)
+
+    def request(self, method, url, payload, headers, timeout=None):
+        if self.request_latency:
+            time.sleep(self.request_latency)
+
+        path = urlsplit(url).path
+        data = json.loads(payload) if payload else dict()
+
+        if path == API_PATH_APP_SIGNUP:
+            return Response(201, b"{}")
+        if path == API_PATH_LOGIN:
+            if data.get('email') not in self.accounts:
+                return Response(401, b'{"message": "unauthorized"}')
+            return self._token_response(200, data['email'])
+        if path == API_PATH_REFRESH_TOKEN:
+            with self._lock:
+                email = self._tokens.get(data.get('refresh_token'))
+            if email is None:
+                return Response(401, b'{"message": "unauthorized"}')
+            return self._token_response(201, email)
+
+        with self._lock:
+            email = self._tokens.get(headers.get('Authorization'))
+            fail = self.error_rate and self._random.random() < self.error_rate
+        if email is None:
+            return Response(401, b'{"message": "unauthorized"}')
+        if fail:
+            return Response(500, b'{"message": "simulated error"}')
+
+        if path == API_PATH_DEVICE_LIST:
+            return _json_response({'device': self.accounts[email]})
+        if path == API_PATH_DEVICE_INFO:
+            return Response(200, self._device_info_body)
+        if path == API_PATH_DEVICE_REGISTERS_MAP:
+            return Response(200, self._registers_map_body)
+        if path == API_PATH_DEVICE_BUFFER_READING:
+            return self._create_job(data['id_device'], None)
+        if path == API_PATH_DEVICE_WRITING:
+            return self._create_job(
+                data['id_device'], list(zip(data['Items'], data['Values']))
+            )
+        if path.startswith(API_PATH_DEVICE_JOB_STATUS):
+            return self._job_status(path[len(API_PATH_DEVICE_JOB_STATUS):])
+        return Response(404, b'{"message": "not found"}')
+
+    def _token_response(self, status, email):
+        with self._lock:
+            self._token_counter += 1
+            claims = {'sub': email, 'jti': self._token_counter}
+            token = make_token(claims=claims)
+            refresh_token = make_token(expires_in=86400, claims=claims)
+            self._tokens[token] = email
+            self._tokens[refresh_token] = email
+        return _json_response(
+            {'token': token, 'refresh_token': refresh_token}, status
+        )
+
+    def _create_job(self, id_device, writes):
+        now = time.monotonic()
+        with self._lock:
+            if id_device not in self._stoves:
+                return Response(404, b'{"message": "unknown device"}')
+            self._job_counter += 1
+            id_request = str.format("job{0}", self._job_counter)
+            self._jobs[id_request] = (now + self.job_latency, id_device, writes)
+            if now - self._last_expiry > JOB_EXPIRY:
+                self._expire_jobs(now)
+        return _json_response({'idRequest': id_request})
+
+    def _expire_jobs(self, now):
+        self._last_expiry = now
+        for id_request, job in list(self._jobs.items()):
+            if job[0] < now - JOB_EXPIRY:
+                del self._jobs[id_request]
+
+    def _job_status(self, id_request):
+        now = time.monotonic()
+        with self._lock:
+            job = self._jobs.get(id_request)
+            if job is None:
+                return Response(404, b'{"message": "unknown job"}')
+            ready_at, id_device, writes = job
+            if now < ready_at:
+                return _json_response({'jobAnswerStatus': "pending"})
+            del self._jobs[id_request]
+
+            stove = self._stoves[id_device]
+            if writes is None:
+                stove.tick(self._random)
+                answer = {
+                    'Items': self._items,
+                    'Values': [stove.values[item] for item in self._items],
+                }
+            else:
+                for item, value in writes:
+                    stove.values[item] = value
+                answer = {'Cmd': 1}
+        return _json_response(
+            {'jobAnswerStatus': "completed", 'jobAnswerData': answer}
+        )
+
+    def set_online(self, id_device, is_online):
+        """Change the is_online flag reported by deviceList for a stove."""
+        with self._lock:
+            self._stoves[id_device].listing['is_online'] = is_online
+
+
+def _json_response(body, status=200):
+    return Response(status, json.dumps(body).encode("utf-8"))
@@ -0,0 +1,358 @@
+"""Local caching gateway exposing Eva Calor devices over HTTP
+
+The gateway logs in once per account, polls all devices on a shared
+PollScheduler and serves the cached state to any number of local
+consumers, so the load on the Agua IOT platform does not depend on how
+many consumers connect::
+
+    pyevacalor-gateway accounts.ndjson --port 8080 --budget 2
+
+Endpoints:
+
+    GET  /devices              snapshots of all devices
+    GET  /devices/<id_device>  snapshot of one device
+    POST /devices/<id_device>  write, e.g. {"set_air_temperature": 21.5},
+                               {"set_power": 3} or {"turn": "on"}
+    GET  /events               server-sent events, one "update" event with
+                               the snapshot after every device update
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+from concurrent.futures import TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .cli import read_accounts
+from .client import evacalor
+from .exceptions import Error
+from .scheduler import PollScheduler
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8080
+DEFAULT_WRITE_TIMEOUT = 60
+EVENT_QUEUE_SIZE = 256
+HEARTBEAT_INTERVAL = 15
+
+
+class EventHub(object):
+    """Fans device snapshots out to server-sent event subscribers
+
+    Every subscriber has a bounded queue; a subscriber too slow to keep up
+    is dropped rather than slowing down the others.
+    """
+
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        subscriber = queue.Queue(self._queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        message = str.format(
+            "event: {0}\ndata: {1}\n\n", event,
+            json.dumps(data, separators=(",", ":"))
+        ).encode("utf-8")
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                _LOGGER.warning("Dropping slow event subscriber")
+                self.unsubscribe(subscriber)
+                _end_stream(subscriber)
+
+    def close(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for subscriber in subscribers:
+            _end_stream(subscriber)
+
+
+def _end_stream(subscriber):
+    """Replace the queued events of subscriber by the end of its stream."""
+    while True:
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            break
+    subscriber.put_nowait(None)
+
+
+class Gateway(object):
+    """Keeps one client per account and serves their devices over HTTP."""
+
+    def __init__(self, accounts, host="127.0.0.1", port=DEFAULT_PORT,
+                 budget=None, workers=8, debug=False, transport=None,
+                 write_timeout=DEFAULT_WRITE_TIMEOUT):
+        self.write_timeout = write_timeout
+        self.scheduler = PollScheduler(budget=budget, workers=workers)
+        self.events = EventHub()
+        self.clients = list()
+        self._devices = dict()
+
+        for account in accounts:
+            client = evacalor(
+                account["email"],
+                account["password"],
+                account["unique_id"],
+                debug=debug,
+                transport=transport,
+            )
+            client.add_update_listener(self._updated)
+            self.scheduler.attach(client)
+            self.clients.append(client)
+            for device in client.devices:
+                self._devices[device.id_device] = device
+
+        self.server = ThreadingHTTPServer((host, port), _GatewayHandler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def _updated(self, device):
+        self._devices[device.id_device] = device
+        self.events.publish("update", device.get_snapshot())
+
+    def device(self, id_device):
+        device = self._devices.get(id_device)
+        if device is None or device.retired:
+            return None
+        return device
+
+    def devices(self):
+        return [
+            device for device in list(self._devices.values())
+            if not device.retired
+        ]
+
+    def write(self, device, request):
+        """Apply a POSTed write to device, returning its WriteFuture."""
+        if 'set_air_temperature' in request:
+            return device.submit_air_temperature(
+                float(request['set_air_temperature'])
+            )
+        if 'set_power' in request:
+            return device.submit_power(int(request['set_power']))
+        if request.get('turn') == "on":
+            return device.submit_turn_on()
+        if request.get('turn') == "off":
+            return device.submit_turn_off()
+        raise ValueError(
+            "Expected set_air_temperature, set_power or turn (on or off)"
+        )
+
+    def serve_forever(self):
+        """Start polling and serve requests until shutdown is called."""
+        self.scheduler.start()
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def close(self):
+        self.events.close()
+        self.scheduler.stop()
+        self.server.server_close()
+        for client in self.clients:
+            client.close()
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    """Request handler of the gateway HTTP API"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "pyevacalor-gateway"
+
+    @property
+    def gateway(self):
+        return self.server.gateway
+
+    def log_message(self, format, *args):
+        _LOGGER.debug("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status, body):
+        content = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': message})
+
+    def _device_path(self):
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "devices":
+            return parts[1]
+        return None
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/devices":
+            self._send_json(200, [
+                device.get_snapshot() for device in self.gateway.devices()
+            ])
+            return
+        if path == "/events":
+            self._stream_events()
+            return
+
+        id_device = self._device_path()
+        if id_device is None:
+            self._send_error(404, "Not found")
+            return
+        device = self.gateway.device(id_device)
+        if device is None:
+            self._send_error(404, "Unknown device")
+            return
+        self._send_json(200, device.get_snapshot())
+
+    def do_POST(self):
+        id_device = self._device_path()
+        if id_device is None:
+            self._send_error(404, "Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_error(400, "Invalid Content-Length")
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "Invalid JSON")
+            return
+        if not isinstance(request, dict):
+            self._send_error(400, "Expected a JSON object")
+            return
+        device = self.gateway.device(id_device)
+        if device is None:
+            self._send_error(404, "Unknown device")
+            return
+
+        try:
+            future = self.gateway.write(device, request)
+            future.result(self.gateway.write_timeout)
+        except (KeyError, TypeError, ValueError) as err:
+            self._send_error(400, str(err))
+            return
+        except Error as err:
+            self._send_error(502, str(err))
+            return
+        except TimeoutError:
+            future.cancel()
+            self._send_error(504, "Write did not complete in time")
+            return
+        self._send_json(200, device.get_snapshot())
+
+    def _stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        subscriber = self.gateway.events.subscribe()
+        try:
+            for device in self.gateway.devices():
+                if device.last_update is not None:
+                    self.wfile.write(str.format(
+                        "event: update\ndata: {0}\n\n",
+                        json.dumps(device.get_snapshot(), separators=(",", ":"))
+                    ).encode("utf-8"))
+            self.wfile.flush()
+            while True:
+                try:
+                    message = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    message = b": heartbeat\n\n"
+                if message is None:
+                    return
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.gateway.events.unsubscribe(subscriber)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pyevacalor-gateway",
+        description="Serve cached Eva Calor device state over local HTTP.",
+    )
+    parser.add_argument(
+        "accounts", help="file with one JSON account object per line"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--budget", type=float, default=None,
+        help="maximum device updates per second over all accounts"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=8,
+        help="number of devices updated concurrently"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="enable debug logging"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    try:
+        gateway = Gateway(
+            read_accounts(args.accounts),
+            host=args.host,
+            port=args.port,
+            budget=args.budget,
+            workers=args.workers,
+            debug=args.debug,
+        )
+    except (OSError, ValueError, Error) as err:
+        print(str.format("pyevacalor-gateway: {0}", err), file=sys.stderr)
+        return 2
+
+    _LOGGER.info(
+        "Serving %d devices on http://%s:%d", len(gateway.devices()),
+        *gateway.address[:2]
+    )
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""Futures for device jobs running on the Agua IOT platform"""
+import json
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+
+from .const import API_PATH_DEVICE_JOB_STATUS, API_URL
+
+JOB_STATE_SUBMITTING = "submitting"
+JOB_STATE_WAITING = "waiting"
+JOB_STATE_COMPLETED = "completed"
+JOB_STATE_FAILED = "failed"
+JOB_STATE_CANCELLED = "cancelled"
+
+
+class WriteFuture(Future):
+    """Future of a register write, resolved when its job completes
+
+    The result is the jobAnswerData of the completed job. id_request is
+    set once deviceRequestWriting has accepted the write, and state follows
+    the job from submitting to completed, failed or cancelled. Cancelling
+    stops waiting for the job; a write already accepted by the platform may
+    still be applied by the device.
+
+    The future can be awaited from a coroutine.
+    """
+
+    def __init__(self, device, item):
+        super().__init__()
+        self.device = device
+        self.item = item
+        self.id_request = None
+        self.state = JOB_STATE_SUBMITTING
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        cancelled = super().cancel()
+        if cancelled:
+            self.state = JOB_STATE_CANCELLED
+            self.cancel_event.set()
+        return cancelled
+
+    def __await__(self):
+        import asyncio
+
+        return asyncio.wrap_future(self).__await__()
+
+    def __repr__(self):
+        return str.format(
+            "<WriteFuture {0} of {1} request={2} state={3}>",
+            self.item, self.device.id_device, self.id_request, self.state
+        )
+
+
+class JobHandle(Future):
+    """Future of a device job polled by a JobTracker
+
+    The result is the last deviceJobStatus response: the completed one, or
+    the last one polled when the deadline passed (False when it could not
+    be fetched). A status request or on_status callback raising resolves
+    the handle with that exception. Cancelling the handle stops polling
+    the job.
+    """
+
+    def __init__(self, id_request, deadline, on_status=None,
+                 cancel_event=None):
+        super().__init__()
+        self.id_request = id_request
+        self.deadline = deadline
+        self.on_status = on_status
+        self.cancel_event = cancel_event
+        self.next_poll = 0
+        self.polling = False
+        self.response = False
+
+    def _resolve(self, result=None, exception=None):
+        if not self.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            self.set_exception(exception)
+        else:
+            self.set_result(result)
+
+    def __repr__(self):
+        return str.format(
+            "<JobHandle {0} done={1}>", self.id_request, self.done()
+        )
+
+
+class JobTracker(object):
+    """Polls the status of all outstanding jobs of a client
+
+    A single scheduler thread polls every tracked job on a shared cadence
+    of the client's job_poll_interval, using a fixed pool of workers for
+    the status requests, so waiting for jobs costs the same number of
+    threads however many are outstanding. The threads exit once no jobs
+    are outstanding and start again with the next tracked job.
+    """
+
+    def __init__(self, client, workers=8):
+        self.client = client
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._jobs = set()
+        self._thread = None
+        self._executor = None
+        self._stopping = False
+
+    def track(self, id_request, timeout=None, on_status=None,
+              cancel_event=None):
+        """Start polling a job and return its JobHandle.
+
+        The job is given up timeout seconds from now, by default the
+        client's job_poll_interval times job_poll_retries. on_status is
+        called with every intermediate jobAnswerStatus, and setting
+        cancel_event cancels the handle.
+        """
+        client = self.client
+        if timeout is None:
+            timeout = client.job_poll_interval * client.job_poll_retries
+        handle = JobHandle(
+            id_request, time.monotonic() + timeout, on_status, cancel_event
+        )
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("JobTracker is closed")
+            self._jobs.add(handle)
+            if self._thread is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix="pyevacalor-job",
+                    )
+                self._thread = threading.Thread(
+                    target=self.__run, name="pyevacalor-jobs", daemon=True
+                )
+                self._thread.start()
+            self._wakeup.notify()
+        return handle
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def close(self, wait=True):
+        """Stop polling.
+
+        With wait, outstanding jobs are first polled until they complete or
+        reach their deadline; otherwise they are cancelled.
+        """
+        if wait:
+            with self._lock:
+                jobs = list(self._jobs)
+            futures_wait(jobs)
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+            self._thread = None
+            jobs = list(self._jobs)
+            self._jobs.clear()
+            self._wakeup.notify()
+        for handle in jobs:
+            handle.cancel()
+        if thread is not None:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __run(self):
+        while True:
+            expired = list()
+            with self._lock:
+                if self._stopping:
+                    return
+                now = time.monotonic()
+                wait = None
+                for handle in list(self._jobs):
+                    cancel_event = handle.cancel_event
+                    if cancel_event is not None and cancel_event.is_set():
+                        handle.cancel()
+                    if handle.done():
+                        self._jobs.discard(handle)
+                        continue
+                    # The deadline holds even while a poll is in flight.
+                    if handle.deadline <= now:
+                        self._jobs.discard(handle)
+                        expired.append(handle)
+                        continue
+                    wait = _earliest(wait, handle.deadline - now)
+                    if handle.polling:
+                        continue
+                    if handle.next_poll <= now:
+                        handle.polling = True
+                        self._executor.submit(self.__poll, handle)
+                    else:
+                        wait = _earliest(wait, handle.next_poll - now)
+                if not self._jobs and not expired:
+                    # Idle: release the threads until the next job.
+                    self._thread = None
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+                    return
+                if not expired:
+                    # Jobs with a cancel_event are checked at least once
+                    # per cadence.
+                    self._wakeup.wait(wait)
+            for handle in expired:
+                handle._resolve(handle.response)
+
+    def __poll(self, handle):
+        url = (API_URL + API_PATH_DEVICE_JOB_STATUS + handle.id_request)
+        try:
+            res = self.client.handle_webcall("GET", url, json.dumps({}))
+            handle.response = res
+            if res is not False and res['jobAnswerStatus'] == "completed":
+                self.__finish(handle, res)
+                return
+            now = time.monotonic()
+            if now >= handle.deadline:
+                self.__finish(handle, res)
+                return
+            if handle.on_status is not None and res is not False:
+                handle.on_status(res['jobAnswerStatus'])
+        except Exception as err:
+            self.__finish(handle, exception=err)
+            return
+
+        # Align polls on a shared grid so outstanding jobs are polled
+        # together once per interval.
+        interval = self.client.job_poll_interval
+        with self._lock:
+            handle.next_poll = (math.floor(now / interval) + 1) * interval
+            handle.polling = False
+            self._wakeup.notify()
+
+    def __finish(self, handle, res=None, exception=None):
+        with self._lock:
+            handle.polling = False
+            # Only the first of the poll and the deadline resolves a job.
+            if handle not in self._jobs:
+                return
+            self._jobs.discard(handle)
+            self._wakeup.notify()
+        handle._resolve(res, exception)
+
+
+def _earliest(wait, delay):
+    return delay if wait is None else min(wait, delay)
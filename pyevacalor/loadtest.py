@@ -0,0 +1,339 @@
+"""Fleet soak and load test against the in-process fake Agua IOT API
+
+Drives real evacalor clients and Device updates for N accounts x M stoves
+against FakeAguaApi and reports sustained polls per second, latency
+percentiles per phase, peak RSS and allocation growth::
+
+    python -m pyevacalor.loadtest --accounts 20 --devices 50 --duration 600
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import evacalor
+from .exceptions import Error
+from .fakeapi import FakeAguaApi
+from .timings import PHASES, PhaseTimings
+
+PHASE_POLL = "poll"
+
+LOGIN_ATTEMPTS = 3
+
+
+def _current_rss():
+    """Return the resident set size in bytes, or None when unknown."""
+    try:
+        import resource
+
+        with open("/proc/self/statm", "r") as fh:
+            return int(fh.read().split()[1]) * resource.getpagesize()
+    except (ImportError, OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss():
+    """Return the peak resident set size in bytes, or None when unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoadTest(object):
+    """Runs a soak test of many clients against a FakeAguaApi"""
+
+    def __init__(self, accounts=10, devices_per_account=10, duration=60.0,
+                 workers=32, job_latency=0.5, job_poll_interval=1.0,
+                 error_rate=0.0, request_latency=0.0, registers=120,
+                 sample_interval=5.0, trace_memory=True):
+        self.accounts = accounts
+        self.devices_per_account = devices_per_account
+        self.duration = duration
+        self.workers = workers
+        self.job_poll_interval = job_poll_interval
+        self.sample_interval = sample_interval
+        self.trace_memory = trace_memory
+
+        self.api = FakeAguaApi(
+            accounts=accounts,
+            devices_per_account=devices_per_account,
+            registers=registers,
+            job_latency=job_latency,
+            error_rate=error_rate,
+            request_latency=request_latency,
+        )
+        self.timings = PhaseTimings()
+        self.samples = list()
+
+        self._lock = threading.Lock()
+        self._polls = 0
+        self._errors = 0
+        self._login_errors = 0
+
+    def _client_class(self):
+        return type("LoadTestClient", (evacalor,), {
+            'job_poll_interval': self.job_poll_interval,
+        })
+
+    def _login(self, client_class, index):
+        email = FakeAguaApi.account_email(index)
+        for attempt in range(LOGIN_ATTEMPTS):
+            try:
+                return client_class(
+                    email, "secret", str(uuid.uuid4()),
+                    timings=self.timings, transport=self.api,
+                )
+            except Error:
+                with self._lock:
+                    self._login_errors += 1
+        return None
+
+    def _poll_loop(self, devices, deadline):
+        while time.monotonic() < deadline:
+            with self._lock:
+                device = next(devices)
+            start = time.perf_counter()
+            try:
+                device.update()
+            except Error:
+                with self._lock:
+                    self._errors += 1
+                continue
+            self.timings.add(PHASE_POLL, time.perf_counter() - start)
+
+    def _fetched(self, device):
+        # Concurrent updates of a device share one fetch, so polls are
+        # counted per completed fetch rather than per update call.
+        with self._lock:
+            self._polls += 1
+
+    def _sample(self, started):
+        with self._lock:
+            polls = self._polls
+            errors = self._errors
+        traced = None
+        if self.trace_memory:
+            traced = tracemalloc.get_traced_memory()[0]
+        self.samples.append({
+            'elapsed': time.monotonic() - started,
+            'polls': polls,
+            'errors': errors,
+            'rss': _current_rss(),
+            'traced': traced,
+        })
+
+    def run(self):
+        """Run the test and return its report as a dict."""
+        if self.trace_memory:
+            tracemalloc.start()
+
+        client_class = self._client_class()
+        login_started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            clients = list(executor.map(
+                lambda index: self._login(client_class, index),
+                range(self.accounts)
+            ))
+        login_elapsed = time.monotonic() - login_started
+        clients = [client for client in clients if client is not None]
+        devices = [device for client in clients for device in client.devices]
+        if not devices:
+            raise Error("No devices available for the load test")
+
+        # Measure the steady state only, not the initial logins.
+        for client in clients:
+            client.add_update_listener(self._fetched)
+        self.timings.reset()
+        baseline = tracemalloc.take_snapshot() if self.trace_memory else None
+
+        started = time.monotonic()
+        deadline = started + self.duration
+        stop = threading.Event()
+
+        def sampler():
+            while not stop.wait(self.sample_interval):
+                self._sample(started)
+
+        self._sample(started)
+        sampler_thread = threading.Thread(target=sampler, daemon=True)
+        sampler_thread.start()
+
+        # More pollers than devices would only wait on fetches in flight.
+        workers = min(self.workers, len(devices))
+        cycle = itertools.cycle(devices)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pollers = [
+                executor.submit(self._poll_loop, cycle, deadline)
+                for _ in range(workers)
+            ]
+
+        stop.set()
+        sampler_thread.join()
+        for poller in pollers:
+            poller.result()
+        self._sample(started)
+        elapsed = time.monotonic() - started
+
+        growth = list()
+        peak_traced = None
+        if self.trace_memory:
+            final = tracemalloc.take_snapshot()
+            peak_traced = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            stats = final.filter_traces(ignore).compare_to(
+                baseline.filter_traces(ignore), "lineno"
+            )
+            for stat in [stat for stat in stats if stat.size_diff > 0][:10]:
+                growth.append({
+                    'location': str(stat.traceback[0]),
+                    'size_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                })
+
+        for client in clients:
+            client.remove_update_listener(self._fetched)
+            client.close()
+
+        traced = [s['traced'] for s in self.samples if s['traced'] is not None]
+        return {
+            'accounts': len(clients),
+            'devices': len(devices),
+            'workers': workers,
+            'login_seconds': login_elapsed,
+            'login_errors': self._login_errors,
+            'duration': elapsed,
+            'polls': self._polls,
+            'errors': self._errors,
+            'polls_per_second': self._polls / elapsed if elapsed else 0.0,
+            'phases': self.timings.summary(),
+            'peak_rss': _peak_rss(),
+            'traced_start': traced[0] if traced else None,
+            'traced_end': traced[-1] if traced else None,
+            'traced_peak': peak_traced,
+            'allocation_growth': growth,
+            'samples': self.samples,
+        }
+
+
+def _megabytes(value):
+    if value is None:
+        return "n/a"
+    return str.format("{0:.1f} MB", value / (1024.0 * 1024.0))
+
+
+def format_report(report):
+    """Render a load test report for humans."""
+    lines = [
+        str.format(
+            "{0} accounts, {1} devices, {2} workers, logins took {3:.2f}s "
+            "({4} login errors)",
+            report['accounts'], report['devices'], report['workers'],
+            report['login_seconds'], report['login_errors']
+        ),
+        str.format(
+            "{0} polls, {1} errors in {2:.1f}s: {3:.2f} polls/s",
+            report['polls'], report['errors'], report['duration'],
+            report['polls_per_second']
+        ),
+        "",
+        str.format(
+            "{0:<14}{1:>9}{2:>11}{3:>11}{4:>11}{5:>11}{6:>11}",
+            "phase", "count", "mean ms", "p50 ms", "p90 ms", "p99 ms",
+            "max ms"
+        ),
+    ]
+    for phase in PHASES + (PHASE_POLL,):
+        stats = report['phases'].get(phase)
+        if stats is None:
+            continue
+        lines.append(str.format(
+            "{0:<14}{1:>9}{2:>11.1f}{3:>11.1f}{4:>11.1f}{5:>11.1f}{6:>11.1f}",
+            phase, stats['count'], stats['mean'] * 1000,
+            stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000,
+            stats['max'] * 1000
+        ))
+    lines.extend([
+        "",
+        str.format("peak RSS: {0}", _megabytes(report['peak_rss'])),
+        str.format(
+            "traced memory: {0} at start, {1} at end, {2} peak",
+            _megabytes(report['traced_start']),
+            _megabytes(report['traced_end']),
+            _megabytes(report['traced_peak'])
+        ),
+    ])
+    if report['allocation_growth']:
+        lines.append("largest allocation growth since steady state began:")
+        for stat in report['allocation_growth']:
+            lines.append(str.format(
+                "  {0:>+12} B {1:>+8} blocks  {2}",
+                stat['size_diff'], stat['count_diff'], stat['location']
+            ))
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="pyevacalor-loadtest",
+        description="Soak test pyevacalor against an in-process fake API.",
+    )
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--devices", type=int, default=10,
+                        help="stoves per account")
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="seconds of steady-state polling")
+    parser.add_argument("--workers", type=int, default=32,
+                        help="threads polling devices concurrently, at most one per device")
+    parser.add_argument("--job-latency", type=float, default=0.5,
+                        help="seconds until a fake job completes")
+    parser.add_argument("--job-poll-interval", type=float, default=1.0,
+                        help="seconds between deviceJobStatus polls")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of API requests answered with HTTP 500")
+    parser.add_argument("--request-latency", type=float, default=0.0,
+                        help="simulated network latency per request")
+    parser.add_argument("--registers", type=int, default=120,
+                        help="registers per registers map")
+    parser.add_argument("--sample-interval", type=float, default=5.0)
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="do not track allocations (lower overhead)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = LoadTest(
+        accounts=args.accounts,
+        devices_per_account=args.devices,
+        duration=args.duration,
+        workers=args.workers,
+        job_latency=args.job_latency,
+        job_poll_interval=args.job_poll_interval,
+        error_rate=args.error_rate,
+        request_latency=args.request_latency,
+        registers=args.registers,
+        sample_interval=args.sample_interval,
+        trace_memory=not args.no_tracemalloc,
+    ).run()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Background refresh of device readings
+
+A BackgroundRefresher keeps every device of a client younger than a
+freshness TTL by fetching a new reading shortly before the last one
+expires, so property reads and get_snapshot never wait for the cloud.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import Error
+
+_LOGGER = logging.getLogger(__name__)
+
+# Weight of the latest fetch duration in the running estimate used to
+# start refreshes ahead of expiry.
+DURATION_SMOOTHING = 0.3
+
+
+class BackgroundRefresher(object):
+    """Refreshes the devices of a client before their readings are ttl
+    seconds old
+
+    A refresh starts lead seconds before expiry; by default lead is 1.5
+    times the device's recent fetch duration (a tenth of the ttl until
+    one was measured), capped at half the ttl. Refreshes run on a pool of
+    workers threads of their own, so they never delay the client's writes,
+    and share fetches in flight with Device.update. Devices due while all
+    workers are busy wait for one. A failed refresh is retried after
+    retry_interval seconds.
+    """
+
+    def __init__(self, client, ttl, lead=None, retry_interval=None,
+                 workers=16):
+        self.client = client
+        self.ttl = ttl
+        self.lead = lead
+        self.workers = workers
+        self.retry_interval = (
+            retry_interval if retry_interval is not None else ttl / 2.0
+        )
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._executor = None
+        self._running = set()
+        self._durations = dict()
+        self._retry_at = dict()
+
+    def start(self):
+        """Start refreshing on a background thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="pyevacalor-refresh",
+            )
+            self._thread = threading.Thread(
+                target=self.__run, name="pyevacalor-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop refreshing; refreshes already started still complete."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._stopping = True
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def due(self, device):
+        """Return the time.time() at which device should be refreshed."""
+        last_update = device.last_update
+        if last_update is None:
+            due = 0
+        else:
+            lead = self.lead
+            if lead is None:
+                duration = self._durations.get(device)
+                lead = self.ttl / 10.0 if duration is None else 1.5 * duration
+            due = last_update + self.ttl - min(lead, self.ttl / 2.0)
+        return max(due, self._retry_at.get(device, 0))
+
+    def __run(self):
+        while True:
+            self._wakeup.clear()
+            if self._stopping:
+                return
+
+            now = time.time()
+            wait = self.ttl
+            for device in list(self.client.devices):
+                if device.retired:
+                    continue
+                with self._lock:
+                    if device in self._running:
+                        continue
+                    due = self.due(device)
+                    if due <= now:
+                        self._running.add(device)
+                    else:
+                        wait = min(wait, due - now)
+                        continue
+                self._executor.submit(self.__refresh, device)
+
+            self._wakeup.wait(wait)
+
+    def __refresh(self, device):
+        started = time.monotonic()
+        try:
+            device._refresh()
+        except Exception as err:
+            if isinstance(err, Error):
+                _LOGGER.warning(
+                    "Refreshing device %s failed: %s", device.id_device, err
+                )
+            else:
+                _LOGGER.exception(
+                    "Error refreshing device %s", device.id_device
+                )
+            with self._lock:
+                self._retry_at[device] = time.time() + self.retry_interval
+        else:
+            duration = time.monotonic() - started
+            with self._lock:
+                self._retry_at.pop(device, None)
+                previous = self._durations.get(device)
+                self._durations[device] = duration if previous is None else (
+                    DURATION_SMOOTHING * duration
+                    + (1 - DURATION_SMOOTHING) * previous
+                )
+        finally:
+            with self._lock:
+                self._running.discard(device)
+            self._wakeup.set()
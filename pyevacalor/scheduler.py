@@ -0,0 +1,414 @@
+"""Adaptive polling of Eva Calor devices
+
+PollScheduler decides when each device is polled next from its last
+reading: stoves igniting, cleaning or in alarm are polled often, stoves
+burning steadily less often and stoves that are off rarely. Intervals grow
+while readings stay unchanged and shrink while temperatures move quickly.
+Devices with writes not yet confirmed by a reading, or boosted explicitly,
+are polled at their minimum interval. A global budget caps the number of
+updates per second across all devices.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import Error
+
+_LOGGER = logging.getLogger(__name__)
+
+STATUS_OFF = 0
+STATUS_ON = 4
+STATUS_ECO_STOP = 7
+STATUS_NO_PELLETS = 9
+
+# Seconds between polls for each decoded status; see evacalor.statusTranslated.
+STATUS_INTERVALS = {
+    STATUS_OFF: 600,
+    1: 15,  # START
+    2: 15,  # LOAD PELLETS
+    3: 15,  # FLAME LIGHT
+    STATUS_ON: 60,
+    5: 30,  # CLEANING FIRE-POT
+    6: 30,  # CLEANING FINAL
+    STATUS_ECO_STOP: 300,
+    STATUS_NO_PELLETS: 30,
+}
+
+
+class RequestBudget(object):
+    """Token bucket allowing rate updates per second with bursts of up to
+    burst updates.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def take(self, now):
+        """Take one token, returning 0 on success or the seconds until one
+        is available.
+        """
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+class _DeviceSchedule(object):
+    """Scheduling state of a single device"""
+
+    __slots__ = (
+        'device', 'min_interval', 'max_interval', 'interval', 'due',
+        'boost_until', 'temperatures', 'polled_at', 'stable', 'failures',
+        'entry', 'running',
+    )
+
+    def __init__(self, device, min_interval, max_interval):
+        self.device = device
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = None
+        self.due = None
+        self.boost_until = 0
+        self.temperatures = None
+        self.polled_at = None
+        self.stable = 0
+        self.failures = 0
+        self.entry = None
+        self.running = False
+
+
+class PollScheduler(object):
+    """Polls devices at intervals adapted to their state
+
+    Devices are kept in a heap ordered by their next due time. start runs
+    the scheduler on a background thread, updating due devices on a pool of
+    workers; run_pending can be called instead to drive it from an existing
+    loop. budget limits the updates per second over all devices.
+    """
+
+    default_interval = 120
+    alarm_interval = 30
+    min_interval = 10
+    max_interval = 1800
+
+    # Unchanged readings stretch the interval by this factor each, up to
+    # max_stable_steps times.
+    stable_growth = 1.5
+    max_stable_steps = 4
+    # Temperatures changing faster than this many degrees per minute halve
+    # the interval.
+    change_threshold = 1.0
+    boost_duration = 120
+
+    def __init__(self, devices=(), budget=None, burst=None, workers=8):
+        self.budget = RequestBudget(budget, burst) if budget else None
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = list()
+        self._counter = itertools.count()
+        self._schedules = dict()
+        # Devices removed explicitly are not scheduled again by updates.
+        self._removed = weakref.WeakSet()
+        self._executor = None
+        self._thread = None
+        self._stopping = False
+        self._dirty = False
+
+        for device in devices:
+            self.add(device)
+
+    def add(self, device, min_interval=None, max_interval=None, due=None):
+        """Schedule device, polling it at due (default: now).
+
+        min_interval and max_interval bound the device's interval and
+        default to the scheduler's.
+        """
+        with self._lock:
+            self._removed.discard(device)
+            schedule = self._schedules.get(device)
+            if schedule is None:
+                schedule = _DeviceSchedule(
+                    device,
+                    min_interval if min_interval is not None else self.min_interval,
+                    max_interval if max_interval is not None else self.max_interval,
+                )
+                self._schedules[device] = schedule
+            else:
+                self.__set_limits(schedule, min_interval, max_interval)
+            if not schedule.running:
+                self.__push(schedule, due if due is not None else time.monotonic())
+
+    def attach(self, client):
+        """Schedule every device of an evacalor client.
+
+        Devices the client picks up later are scheduled after their first
+        update, and every successful write boosts its device.
+        """
+        now = time.monotonic()
+        for device in client.devices:
+            # Devices read at login are not polled again straight away.
+            if device.last_update is None:
+                self.add(device)
+            else:
+                self.add(device, due=now + self.state_interval(device))
+        client.add_update_listener(self.__updated)
+        client.add_write_listener(self.__written)
+
+    def detach(self, client):
+        """Stop polling the devices of a client passed to attach."""
+        client.remove_update_listener(self.__updated)
+        client.remove_write_listener(self.__written)
+        for device in client.devices:
+            self.remove(device)
+
+    def __updated(self, device):
+        if (device in self._schedules or device in self._removed
+                or device.retired):
+            return
+        self.add(device, due=time.monotonic() + self.state_interval(device))
+
+    def __written(self, device, item):
+        self.boost(device)
+
+    def remove(self, device):
+        """Stop polling device until it is added again."""
+        with self._lock:
+            self._removed.add(device)
+            schedule = self._schedules.pop(device, None)
+            if schedule is not None:
+                self.__discard(schedule)
+
+    def set_limits(self, device, min_interval=None, max_interval=None):
+        """Change the interval bounds of a scheduled device."""
+        with self._lock:
+            self.__set_limits(self._schedules[device], min_interval, max_interval)
+
+    def boost(self, device, duration=None):
+        """Poll device at its minimum interval for the next duration
+        seconds, starting now.
+        """
+        now = time.monotonic()
+        with self._lock:
+            schedule = self._schedules.get(device)
+            if schedule is None:
+                return
+            schedule.boost_until = now + (
+                duration if duration is not None else self.boost_duration
+            )
+            schedule.stable = 0
+            if not schedule.running:
+                self.__push(schedule, now)
+
+    def next_poll(self, device):
+        """Return the monotonic time device is next due, or None."""
+        with self._lock:
+            schedule = self._schedules.get(device)
+            return None if schedule is None else schedule.due
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def __set_limits(self, schedule, min_interval, max_interval):
+        if min_interval is not None:
+            schedule.min_interval = min_interval
+        if max_interval is not None:
+            schedule.max_interval = max_interval
+
+    def __push(self, schedule, due):
+        self.__discard(schedule)
+        schedule.due = due
+        schedule.entry = [due, next(self._counter), schedule]
+        heapq.heappush(self._heap, schedule.entry)
+        self._dirty = True
+        self._wakeup.notify()
+
+    def __discard(self, schedule):
+        # Entries are invalidated in place and skipped when popped.
+        if schedule.entry is not None:
+            schedule.entry[2] = None
+            schedule.entry = None
+            schedule.due = None
+
+    def run_pending(self, now=None, submit=None):
+        """Start the updates that are due and allowed by the budget.
+
+        Each due device is passed to submit, which defaults to running the
+        update on the scheduler's worker pool. Returns the number of seconds
+        until the next device is due or a token is available, or None when
+        nothing is scheduled.
+        """
+        if submit is None:
+            submit = self.__submit
+        due = list()
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            self._dirty = False
+            wait = None
+            while self._heap:
+                entry = self._heap[0]
+                schedule = entry[2]
+                if schedule is None:
+                    heapq.heappop(self._heap)
+                    continue
+                if schedule.device.retired:
+                    heapq.heappop(self._heap)
+                    self._schedules.pop(schedule.device, None)
+                    continue
+                if entry[0] > now:
+                    wait = entry[0] - now
+                    break
+                if self.budget is not None:
+                    wait = self.budget.take(now)
+                    if wait:
+                        break
+                heapq.heappop(self._heap)
+                schedule.entry = None
+                schedule.running = True
+                due.append(schedule)
+
+        for schedule in due:
+            submit(schedule.device)
+        return wait
+
+    def __submit(self, device):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="pyevacalor-poll",
+            )
+        self._executor.submit(self.poll, device)
+
+    def poll(self, device):
+        """Update device now and schedule its next poll."""
+        error = None
+        try:
+            device.update()
+        except Error as err:
+            error = err
+            _LOGGER.warning(
+                "Updating device %s failed: %s", device.id_device, err
+            )
+        except Exception as err:
+            error = err
+            _LOGGER.exception("Error updating device %s", device.id_device)
+        self.reschedule(device, failed=error is not None)
+
+    def reschedule(self, device, failed=False, now=None):
+        """Schedule the next poll of device after an update."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            schedule = self._schedules.get(device)
+            if schedule is None:
+                return
+            schedule.running = False
+            if failed:
+                schedule.failures += 1
+                interval = min(
+                    schedule.max_interval,
+                    schedule.min_interval * 2 ** schedule.failures
+                )
+            else:
+                schedule.failures = 0
+                interval = self.__next_interval(schedule, now)
+            schedule.interval = interval
+            self.__push(schedule, now + interval)
+
+    def __next_interval(self, schedule, now):
+        device = schedule.device
+
+        temperatures = _read(lambda: (
+            device.air_temperature, device.gas_temperature
+        ))
+        previous, polled_at = schedule.temperatures, schedule.polled_at
+        schedule.temperatures = temperatures
+        schedule.polled_at = now
+
+        if schedule.boost_until > now or device.pending_items:
+            return schedule.min_interval
+
+        interval = self.state_interval(device)
+
+        if temperatures is None or previous is None or now <= polled_at:
+            schedule.stable = 0
+        elif temperatures == previous:
+            schedule.stable = min(schedule.stable + 1, self.max_stable_steps)
+        else:
+            schedule.stable = 0
+            minutes = (now - polled_at) / 60.0
+            change = max(
+                abs(current - last)
+                for current, last in zip(temperatures, previous)
+            ) / minutes
+            if change >= self.change_threshold:
+                interval /= 2.0
+
+        interval *= self.stable_growth ** schedule.stable
+        return max(schedule.min_interval, min(schedule.max_interval, interval))
+
+    def state_interval(self, device):
+        """Return the base interval for the decoded state of device."""
+        alarms = _read(lambda: float(device.alarms))
+        if alarms:
+            return self.alarm_interval
+        status = _read(lambda: device.status)
+        if status is None:
+            return self.default_interval
+        return STATUS_INTERVALS.get(status, self.default_interval)
+
+    def start(self):
+        """Run the scheduler on a background thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self.__run, name="pyevacalor-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, wait=True):
+        """Stop the background thread and the update workers."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._stopping = True
+            self._wakeup.notify()
+        if thread is not None and wait:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __run(self):
+        while True:
+            wait = self.run_pending()
+            with self._lock:
+                if self._stopping:
+                    return
+                # Devices pushed since run_pending looked at the heap may be
+                # due earlier than wait.
+                if not self._dirty:
+                    self._wakeup.wait(wait)
+                if self._stopping:
+                    return
+
+
+def _read(getter):
+    """Return getter(), or None when the value is not in the reading."""
+    try:
+        return getter()
+    except (KeyError, IndexError, ValueError, TypeError):
+        return None
@@ -0,0 +1,219 @@
+"""Multi-process fleet poller
+
+ShardedPoller spreads accounts over worker processes so decoding and JSON
+parsing for a large fleet use more than one core. Each worker runs its own
+FleetPoller, with its own evacalor clients, and streams compact readings
+back to the parent through a pipe; the parent writes them as NDJSON.
+
+A worker that dies is restarted with the accounts it had not finished, up
+to max_restarts times per shard. Restarted accounts start again from
+their first polling round.
+"""
+import logging
+import multiprocessing
+import threading
+from multiprocessing.connection import wait
+
+from .cli import DEFAULT_WORKERS, FleetPoller
+from .device import SNAPSHOT_ATTRIBUTES
+
+_LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_KEYS = (
+    'id_device', 'id_product', 'name', 'name_product', 'is_online',
+    'last_update', 'pending',
+) + SNAPSHOT_ATTRIBUTES
+
+MSG_READINGS = "readings"
+MSG_ACCOUNT_DONE = "account_done"
+MSG_FINISHED = "finished"
+
+DEFAULT_MAX_RESTARTS = 3
+
+
+def assign_shards(accounts, shards):
+    """Split accounts over shards, balancing their expected device counts.
+
+    An account may carry a "devices" hint with its number of devices; it
+    counts as one otherwise. Returns a list of shards holding
+    (index, account) pairs, index being the account's position.
+    """
+    weighted = sorted(
+        enumerate(accounts),
+        key=lambda pair: pair[1].get("devices", 1),
+        reverse=True
+    )
+    loads = [0] * shards
+    assigned = [list() for _ in range(shards)]
+    for index, account in weighted:
+        shard = loads.index(min(loads))
+        loads[shard] += account.get("devices", 1)
+        assigned[shard].append((index, account))
+    return [sorted(shard) for shard in assigned if shard]
+
+
+class _PipeWriter(object):
+    """Writer sending snapshots to the parent as tuples of SNAPSHOT_KEYS"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    def write_many(self, snapshots):
+        rows = [
+            tuple(snapshot[key] for key in SNAPSHOT_KEYS)
+            for snapshot in snapshots
+        ]
+        self.send((MSG_READINGS, rows))
+
+    def send(self, message):
+        with self._lock:
+            self._conn.send(message)
+
+
+class _ShardPoller(FleetPoller):
+    """FleetPoller batching readings and reporting finished accounts"""
+
+    def _poll_account(self, item):
+        index, account = item
+        super()._poll_account(account)
+        self.writer.send((MSG_ACCOUNT_DONE, index))
+
+    def _emit(self, devices):
+        if devices:
+            self.writer.write_many(
+                [device.get_snapshot() for device in devices]
+            )
+
+
+def _run_shard(conn, accounts, options):
+    """Entry point of a worker process."""
+    logging.basicConfig(
+        level=logging.DEBUG if options['debug'] else logging.WARNING
+    )
+    timings = None
+    if options['bench']:
+        from .timings import PhaseTimings
+
+        timings = PhaseTimings()
+
+    writer = _PipeWriter(conn)
+    poller = _ShardPoller(
+        writer,
+        workers=options['workers'],
+        count=options['count'],
+        interval=options['interval'],
+        timings=timings,
+        debug=options['debug'],
+    )
+    poller.run(accounts)
+    writer.send((
+        MSG_FINISHED,
+        poller.failures,
+        timings.export() if timings is not None else None,
+    ))
+    conn.close()
+
+
+class _Shard(object):
+    """A worker process and the accounts it has not finished yet"""
+
+    def __init__(self, number, accounts):
+        self.number = number
+        self.remaining = dict(accounts)
+        self.restarts = 0
+        self.finished = False
+        self.process = None
+        self.conn = None
+
+
+class ShardedPoller(object):
+    """Polls the devices of many accounts from several processes."""
+
+    def __init__(self, writer, processes=None, workers=DEFAULT_WORKERS,
+                 count=1, interval=60.0, timings=None, debug=False,
+                 max_restarts=DEFAULT_MAX_RESTARTS, start_method=None):
+        self.writer = writer
+        self.processes = processes or multiprocessing.cpu_count()
+        self.workers = workers
+        self.count = count
+        self.interval = interval
+        self.timings = timings
+        self.debug = debug
+        self.max_restarts = max_restarts
+        self.failures = 0
+        self._context = multiprocessing.get_context(start_method)
+
+    def run(self, accounts):
+        """Poll every account, returning once all shards have finished."""
+        shards = [
+            _Shard(number, assigned) for number, assigned in
+            enumerate(assign_shards(list(accounts), self.processes))
+        ]
+        for shard in shards:
+            self._start(shard)
+
+        running = dict((shard.conn, shard) for shard in shards)
+        while running:
+            for conn in wait(list(running)):
+                shard = running[conn]
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    del running[conn]
+                    if self._exited(shard):
+                        running[shard.conn] = shard
+                    continue
+                self._handle(shard, message)
+
+    def _start(self, shard):
+        options = {
+            'workers': self.workers,
+            'count': self.count,
+            'interval': self.interval,
+            'bench': self.timings is not None,
+            'debug': self.debug,
+        }
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        shard.conn = parent_conn
+        shard.process = self._context.Process(
+            target=_run_shard,
+            args=(child_conn, sorted(shard.remaining.items()), options),
+            name=str.format("pyevacalor-shard-{0}", shard.number),
+            daemon=True,
+        )
+        shard.process.start()
+        child_conn.close()
+
+    def _handle(self, shard, message):
+        kind = message[0]
+        if kind == MSG_READINGS:
+            for row in message[1]:
+                self.writer.write(dict(zip(SNAPSHOT_KEYS, row)))
+        elif kind == MSG_ACCOUNT_DONE:
+            shard.remaining.pop(message[1], None)
+        elif kind == MSG_FINISHED:
+            shard.finished = True
+            self.failures += message[1]
+            if message[2] is not None and self.timings is not None:
+                self.timings.merge(message[2])
+
+    def _exited(self, shard):
+        """Reap a worker whose pipe closed, restarting it when it died
+        with accounts left. Returns True when it was restarted.
+        """
+        shard.conn.close()
+        shard.process.join()
+        if shard.finished or not shard.remaining:
+            return False
+
+        _LOGGER.error(
+            "Shard %d exited with code %s, %d accounts unfinished",
+            shard.number, shard.process.exitcode, len(shard.remaining)
+        )
+        if shard.restarts >= self.max_restarts:
+            self.failures += len(shard.remaining)
+            return False
+        shard.restarts += 1
+        self._start(shard)
+        return True
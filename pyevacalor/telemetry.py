@@ -0,0 +1,322 @@
+"""Compact append-only binary log of raw Eva Calor buffer readings
+
+A log is a directory holding a device index and numbered segment files::
+
+    devices.txt             one id_device per line, line number = index
+    segment-00000001.evtl
+    segment-00000002.evtl
+
+Each segment starts with a header describing the register offsets (the
+``Items`` of the buffer reading) of its records, followed by fixed-size
+little-endian records::
+
+    header:  magic "EVTL", u16 version, u16 reserved, u32 item count,
+             item count x i32 register offset
+    record:  f64 timestamp, u32 device index, item count x i32 value
+
+Readings with different register layouts go to separate segments, one
+open segment per layout, and a layout's segment is replaced by a new one
+when it reaches the configured size.
+"""
+import mmap
+import os
+import struct
+import sys
+import threading
+from collections import namedtuple
+
+MAGIC = b"EVTL"
+VERSION = 1
+
+DEVICE_INDEX_FILE = "devices.txt"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".evtl"
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+_HEADER = struct.Struct("<4sHHI")
+_RECORD_PREFIX = struct.Struct("<dI")
+_VALUE = struct.Struct("<i")
+
+_NATIVE_LITTLE_ENDIAN = sys.byteorder == "little"
+
+TelemetryRecord = namedtuple(
+    "TelemetryRecord", ["timestamp", "id_device", "items", "values"]
+)
+
+
+def _segment_name(sequence):
+    return str.format("{0}{1:08d}{2}", SEGMENT_PREFIX, sequence, SEGMENT_SUFFIX)
+
+
+def _segment_sequences(directory):
+    sequences = list()
+    for filename in os.listdir(directory):
+        if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX):
+            number = filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            if number.isdigit():
+                sequences.append(int(number))
+    return sorted(sequences)
+
+
+def _read_device_index(directory):
+    path = os.path.join(directory, DEVICE_INDEX_FILE)
+    if not os.path.exists(path):
+        return list()
+    with open(path, "r") as fh:
+        return [line.rstrip("\n") for line in fh]
+
+
+class TelemetryRecorder(object):
+    """Appends raw buffer readings to a segmented binary log."""
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._device_ids = _read_device_index(directory)
+        self._device_index = dict(
+            (id_device, index) for index, id_device in enumerate(self._device_ids)
+        )
+        self._device_file = open(
+            os.path.join(directory, DEVICE_INDEX_FILE), "a"
+        )
+
+        sequences = _segment_sequences(directory)
+        self._next_sequence = (sequences[-1] + 1) if sequences else 1
+        self._segments = dict()
+        self._clients = list()
+
+    def attach(self, client):
+        """Record every future update of the devices of an evacalor client."""
+        client.add_update_listener(self.record)
+        self._clients.append(client)
+
+    def detach(self, client):
+        """Stop recording the updates of a client passed to attach."""
+        client.remove_update_listener(self.record)
+        self._clients.remove(client)
+
+    def record(self, device):
+        """Append the last buffer reading of device."""
+        self.append(
+            device.id_device,
+            device.last_update,
+            device.buffer_items,
+            device.buffer_values,
+        )
+
+    def append(self, id_device, timestamp, items, values):
+        """Append a single reading to the log."""
+        # The device index is text, so ids are always looked up as str.
+        id_device = str(id_device)
+        items = tuple(int(item) for item in items)
+        if len(items) != len(values):
+            raise ValueError("Items and values must have the same length")
+
+        with self._lock:
+            if self._device_file is None:
+                raise ValueError("Recorder is closed")
+
+            index = self._device_index.get(id_device)
+            if index is None:
+                index = len(self._device_ids)
+                self._device_file.write(id_device + "\n")
+                self._device_file.flush()
+                self._device_ids.append(id_device)
+                self._device_index[id_device] = index
+
+            segment = self._segments.get(items)
+            if (segment is None
+                    or segment.size + segment.record.size > self.segment_size):
+                segment = self._open_segment(items)
+
+            try:
+                data = segment.record.pack(timestamp, index, *values)
+            except struct.error as err:
+                raise ValueError(str.format("Cannot pack reading: {0}", err))
+            segment.file.write(data)
+            segment.size += len(data)
+
+    def _open_segment(self, items):
+        previous = self._segments.pop(items, None)
+        if previous is not None:
+            previous.file.close()
+
+        path = os.path.join(self.directory, _segment_name(self._next_sequence))
+        self._next_sequence += 1
+
+        header = _HEADER.pack(MAGIC, VERSION, 0, len(items))
+        header += struct.pack(str.format("<{0}i", len(items)), *items)
+
+        segment = _OpenSegment(open(path, "xb"), items)
+        segment.file.write(header)
+        segment.size = len(header)
+        self._segments[items] = segment
+        return segment
+
+    def flush(self):
+        """Flush buffered records to disk."""
+        with self._lock:
+            for segment in self._segments.values():
+                segment.file.flush()
+
+    def close(self):
+        """Detach from all clients and close the log files."""
+        for client in list(self._clients):
+            self.detach(client)
+        with self._lock:
+            for segment in self._segments.values():
+                segment.file.close()
+            self._segments.clear()
+            if self._device_file is not None:
+                self._device_file.close()
+                self._device_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _OpenSegment(object):
+    """A segment file being appended to."""
+
+    def __init__(self, file, items):
+        self.file = file
+        self.items = items
+        self.size = 0
+        self.record = struct.Struct(str.format("<dI{0}i", len(items)))
+
+
+class _Segment(object):
+    """A memory-mapped segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fh:
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, item_count = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError(str.format("{0} is not a telemetry segment", path))
+
+        self.items = struct.unpack_from(
+            str.format("<{0}i", item_count), self.map, _HEADER.size
+        )
+        self.item_positions = dict(
+            (item, position) for position, item in enumerate(self.items)
+        )
+        self.data_offset = _HEADER.size + 4 * item_count
+        self.record_size = _RECORD_PREFIX.size + 4 * item_count
+        # A partially written trailing record is ignored.
+        self.count = (len(self.map) - self.data_offset) // self.record_size
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Record views are still alive, the map is released with them.
+            pass
+
+
+class TelemetryReader(object):
+    """Memory-mapped reader for logs written by TelemetryRecorder.
+
+    Record values are returned as memoryviews into the mapped segments, so
+    scanning does not copy record data. The views are only valid while the
+    reader is open; segments still referenced by a view when close is called
+    are unmapped once the last view is garbage collected.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.device_ids = _read_device_index(directory)
+        self._segments = list()
+        for sequence in _segment_sequences(directory):
+            path = os.path.join(directory, _segment_name(sequence))
+            if os.path.getsize(path) < _HEADER.size:
+                continue
+            self._segments.append(_Segment(path))
+
+    def __len__(self):
+        return sum(segment.count for segment in self._segments)
+
+    def __iter__(self):
+        return self.records()
+
+    def _device_filter(self, id_device):
+        if id_device is None:
+            return None
+        try:
+            return self.device_ids.index(str(id_device))
+        except ValueError:
+            return -1
+
+    def records(self, id_device=None, start=None, end=None):
+        """Yield TelemetryRecords, optionally filtered by device and time."""
+        wanted = self._device_filter(id_device)
+        for segment in self._segments:
+            view = memoryview(segment.map)
+            try:
+                offset = segment.data_offset
+                for _ in range(segment.count):
+                    timestamp, index = _RECORD_PREFIX.unpack_from(
+                        segment.map, offset
+                    )
+                    if ((wanted is None or index == wanted)
+                            and (start is None or timestamp >= start)
+                            and (end is None or timestamp < end)):
+                        values = view[
+                            offset + _RECORD_PREFIX.size:
+                            offset + segment.record_size
+                        ]
+                        if _NATIVE_LITTLE_ENDIAN:
+                            values = values.cast("i")
+                        else:
+                            values = struct.unpack(
+                                str.format("<{0}i", len(segment.items)), values
+                            )
+                        yield TelemetryRecord(
+                            timestamp, self.device_ids[index], segment.items,
+                            values
+                        )
+                    offset += segment.record_size
+            finally:
+                view.release()
+
+    def series(self, offset, id_device=None, start=None, end=None):
+        """Yield (timestamp, value) pairs for a single register offset."""
+        wanted = self._device_filter(id_device)
+        for segment in self._segments:
+            position = segment.item_positions.get(offset)
+            if position is None:
+                continue
+            value_offset = _RECORD_PREFIX.size + 4 * position
+            record_offset = segment.data_offset
+            for _ in range(segment.count):
+                timestamp, index = _RECORD_PREFIX.unpack_from(
+                    segment.map, record_offset
+                )
+                if ((wanted is None or index == wanted)
+                        and (start is None or timestamp >= start)
+                        and (end is None or timestamp < end)):
+                    yield timestamp, _VALUE.unpack_from(
+                        segment.map, record_offset + value_offset
+                    )[0]
+                record_offset += segment.record_size
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,130 @@
+"""Wall-clock timing of the phases of Eva Calor API interactions"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+PHASE_LOGIN = "login"
+PHASE_DEVICE_LIST = "device_list"
+PHASE_REGISTER_MAP = "register_map"
+PHASE_BUFFER_READ = "buffer_read"
+PHASE_JOB_WAIT = "job_wait"
+
+PHASES = (
+    PHASE_LOGIN,
+    PHASE_DEVICE_LIST,
+    PHASE_REGISTER_MAP,
+    PHASE_BUFFER_READ,
+    PHASE_JOB_WAIT,
+)
+
+
+class PhaseTimings(object):
+    """Thread-safe collector of phase durations.
+
+    Count, total, min and max are exact; percentiles are computed from a
+    bounded reservoir sample so memory stays constant on long runs.
+    """
+
+    def __init__(self, reservoir_size=10000):
+        self._reservoir_size = reservoir_size
+        self._lock = threading.Lock()
+        self._phases = dict()
+
+    @contextmanager
+    def measure(self, phase):
+        """Time the enclosed block and record it under phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase, duration):
+        """Record a single duration (in seconds) for phase."""
+        with self._lock:
+            stats = self._phases.get(phase)
+            if stats is None:
+                stats = {
+                    'count': 0,
+                    'total': 0.0,
+                    'min': duration,
+                    'max': duration,
+                    'samples': list(),
+                }
+                self._phases[phase] = stats
+
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['min'] = min(stats['min'], duration)
+            stats['max'] = max(stats['max'], duration)
+
+            samples = stats['samples']
+            if len(samples) < self._reservoir_size:
+                samples.append(duration)
+            else:
+                slot = random.randrange(stats['count'])
+                if slot < self._reservoir_size:
+                    samples[slot] = duration
+
+    def summary(self):
+        """Return per-phase statistics in seconds, keyed by phase name."""
+        with self._lock:
+            phases = [
+                (phase, dict(stats, samples=sorted(stats['samples'])))
+                for phase, stats in self._phases.items()
+            ]
+
+        summary = dict()
+        for phase, stats in phases:
+            samples = stats['samples']
+            summary[phase] = {
+                'count': stats['count'],
+                'total': stats['total'],
+                'mean': stats['total'] / stats['count'],
+                'min': stats['min'],
+                'max': stats['max'],
+                'p50': _percentile(samples, 50),
+                'p90': _percentile(samples, 90),
+                'p99': _percentile(samples, 99),
+            }
+        return summary
+
+    def export(self):
+        """Return the recorded statistics as plain data for merge."""
+        with self._lock:
+            return dict(
+                (phase, dict(stats, samples=list(stats['samples'])))
+                for phase, stats in self._phases.items()
+            )
+
+    def merge(self, exported):
+        """Add statistics returned by export of another PhaseTimings."""
+        with self._lock:
+            for phase, other in exported.items():
+                stats = self._phases.get(phase)
+                if stats is None:
+                    self._phases[phase] = dict(
+                        other, samples=list(other['samples'])
+                    )
+                    continue
+                stats['count'] += other['count']
+                stats['total'] += other['total']
+                stats['min'] = min(stats['min'], other['min'])
+                stats['max'] = max(stats['max'], other['max'])
+                samples = stats['samples'] + other['samples']
+                if len(samples) > self._reservoir_size:
+                    samples = random.sample(samples, self._reservoir_size)
+                stats['samples'] = samples
+
+    def reset(self):
+        """Forget all recorded durations."""
+        with self._lock:
+            self._phases.clear()
+
+
+def _percentile(sorted_samples, percent):
+    if not sorted_samples:
+        return None
+    index = int(round((percent / 100.0) * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
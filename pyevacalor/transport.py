@@ -0,0 +1,383 @@
+"""HTTP transports used for all calls to the Agua IOT API
+
+A transport sends a single request and returns a Response. The HTTP
+libraries are only imported when a transport sends its first request, so
+importing pyevacalor stays cheap.
+
+RecordingTransport and ReplayTransport capture and replay API exchanges
+as NDJSON fixtures for offline regression and performance tests.
+"""
+import base64
+import json
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from .const import (
+    API_PATH_APP_SIGNUP,
+    API_PATH_LOGIN,
+    API_PATH_REFRESH_TOKEN,
+    DEFAULT_TIMEOUT_VALUE,
+)
+from .exceptions import ConnectionError, Error
+
+AUTH_PATHS = (API_PATH_APP_SIGNUP, API_PATH_LOGIN, API_PATH_REFRESH_TOKEN)
+
+STREAM_CHUNK_SIZE = 16384
+
+
+class Response(object):
+    """HTTP response returned by a transport"""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=STREAM_CHUNK_SIZE):
+        """Yield the body in chunks of at most chunk_size bytes."""
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        """Release the connection of a streamed response."""
+
+
+class StreamedResponse(Response):
+    """HTTP response whose body is read from the connection on demand
+
+    iter_content(chunk_size) is the iter_content function of the
+    underlying library; close releases the connection.
+    """
+
+    def __init__(self, status_code, iter_content, close):
+        self.status_code = status_code
+        self._iter_content = iter_content
+        self._close = close
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b"".join(self._iter_content(STREAM_CHUNK_SIZE))
+        return self._content
+
+    def iter_content(self, chunk_size=STREAM_CHUNK_SIZE):
+        if self._content is not None:
+            return super().iter_content(chunk_size)
+        return self._iter_content(chunk_size)
+
+    def close(self):
+        self._close()
+
+
+class Transport(object):
+    """Base class of all transports"""
+
+    def request(self, method, url, payload, headers,
+                timeout=DEFAULT_TIMEOUT_VALUE):
+        """Send a request, raising ConnectionError when the API is
+        unreachable.
+        """
+        raise NotImplementedError
+
+    def request_stream(self, method, url, payload, headers,
+                       timeout=DEFAULT_TIMEOUT_VALUE):
+        """Send a request and return a response whose body is read with
+        iter_content. The caller must close the response.
+
+        Transports that cannot stream return the complete response.
+        """
+        return self.request(method, url, payload, headers, timeout=timeout)
+
+    def close(self):
+        """Release the connections held by the transport."""
+
+
+class RequestsTransport(Transport):
+    """Transport using a requests session with connection keep-alive"""
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+
+                    self._session = requests.Session()
+        return self._session
+
+    def request(self, method, url, payload, headers,
+                timeout=DEFAULT_TIMEOUT_VALUE):
+        import requests
+
+        try:
+            response = self._get_session().request(method,
+                                                   url,
+                                                   data=payload,
+                                                   headers=headers,
+                                                   allow_redirects=False,
+                                                   timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            raise ConnectionError(str.format("Connection to {0} not possible", url))
+        return Response(response.status_code, response.content)
+
+    def request_stream(self, method, url, payload, headers,
+                       timeout=DEFAULT_TIMEOUT_VALUE):
+        import requests
+
+        try:
+            response = self._get_session().request(method,
+                                                   url,
+                                                   data=payload,
+                                                   headers=headers,
+                                                   allow_redirects=False,
+                                                   timeout=timeout,
+                                                   stream=True)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            raise ConnectionError(str.format("Connection to {0} not possible", url))
+        return StreamedResponse(
+            response.status_code,
+            lambda chunk_size: _wrap_stream_errors(
+                response.iter_content(chunk_size),
+                (requests.exceptions.ConnectionError,
+                 requests.exceptions.Timeout,
+                 requests.exceptions.ChunkedEncodingError),
+                url
+            ),
+            lambda: _drain_and_close(response, requests.exceptions.RequestException)
+        )
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class Urllib3Transport(Transport):
+    """Transport using a urllib3 pool manager directly"""
+
+    def __init__(self, maxsize=10):
+        self._maxsize = maxsize
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    import urllib3
+
+                    self._pool = urllib3.PoolManager(maxsize=self._maxsize)
+        return self._pool
+
+    def request(self, method, url, payload, headers,
+                timeout=DEFAULT_TIMEOUT_VALUE):
+        import urllib3
+
+        try:
+            response = self._get_pool().request(method,
+                                                url,
+                                                body=payload,
+                                                headers=headers,
+                                                redirect=False,
+                                                retries=False,
+                                                timeout=timeout)
+        except urllib3.exceptions.HTTPError:
+            raise ConnectionError(str.format("Connection to {0} not possible", url))
+        return Response(response.status, response.data)
+
+    def request_stream(self, method, url, payload, headers,
+                       timeout=DEFAULT_TIMEOUT_VALUE):
+        import urllib3
+
+        try:
+            response = self._get_pool().request(method,
+                                                url,
+                                                body=payload,
+                                                headers=headers,
+                                                redirect=False,
+                                                retries=False,
+                                                timeout=timeout,
+                                                preload_content=False)
+        except urllib3.exceptions.HTTPError:
+            raise ConnectionError(str.format("Connection to {0} not possible", url))
+
+        def close():
+            response.drain_conn()
+            response.release_conn()
+
+        return StreamedResponse(
+            response.status,
+            lambda chunk_size: _wrap_stream_errors(
+                response.stream(chunk_size, decode_content=True),
+                (urllib3.exceptions.HTTPError,),
+                url
+            ),
+            close
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.clear()
+            self._pool = None
+
+
+def _drain_and_close(response, errors):
+    """Read the rest of a requests response so its connection is reused."""
+    try:
+        for _ in response.iter_content(STREAM_CHUNK_SIZE):
+            pass
+    except errors:
+        pass
+    response.close()
+
+
+def _wrap_stream_errors(chunks, errors, url):
+    """Yield from chunks, turning the library's errors into
+    ConnectionError.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    except errors:
+        raise ConnectionError(str.format("Connection to {0} lost", url))
+
+
+def _normalize_payload(payload):
+    if not payload:
+        return None
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return payload
+
+
+def _exchange_key(method, path, payload):
+    return (method, path, json.dumps(payload, sort_keys=True))
+
+
+class RecordingTransport(Transport):
+    """Transport recording the exchanges of another transport to a file
+
+    Each exchange is appended to path as one JSON line. Authentication
+    exchanges are never recorded so fixtures hold no credentials or tokens;
+    pass paths to only record API paths starting with one of its entries.
+    """
+
+    def __init__(self, transport, path, paths=None):
+        self._transport = transport
+        self._paths = tuple(paths) if paths is not None else None
+        self._lock = threading.Lock()
+        self._fh = open(path, "a")
+
+    def request(self, method, url, payload, headers,
+                timeout=DEFAULT_TIMEOUT_VALUE):
+        response = self._transport.request(method, url, payload, headers,
+                                           timeout=timeout)
+
+        path = urlsplit(url).path
+        if path in AUTH_PATHS:
+            return response
+        if self._paths is not None and not path.startswith(self._paths):
+            return response
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.content.decode("utf-8", "replace")
+
+        line = json.dumps({
+            'method': method,
+            'path': path,
+            'payload': _normalize_payload(payload),
+            'status': response.status_code,
+            'body': body,
+        }, separators=(",", ":"))
+        with self._lock:
+            self._fh.write(line + "\n")
+            self._fh.flush()
+        return response
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+        self._transport.close()
+
+
+class ReplayTransport(Transport):
+    """Transport answering requests from a file written by
+    RecordingTransport.
+
+    Recorded responses for the same method, path and payload are replayed
+    in the order they were recorded; the last one is repeated once they
+    are exhausted. Authentication requests are answered with a synthetic
+    token so no credentials are needed.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._exchanges = dict()
+        with open(path, "r") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                exchange = json.loads(line)
+                key = _exchange_key(
+                    exchange['method'], exchange['path'], exchange['payload']
+                )
+                self._exchanges.setdefault(key, deque()).append(
+                    (exchange['status'], exchange['body'])
+                )
+
+    def request(self, method, url, payload, headers,
+                timeout=DEFAULT_TIMEOUT_VALUE):
+        path = urlsplit(url).path
+        if path in AUTH_PATHS:
+            return _auth_response(path)
+
+        key = _exchange_key(method, path, _normalize_payload(payload))
+        with self._lock:
+            responses = self._exchanges.get(key)
+            if not responses:
+                raise Error(str.format(
+                    "No recorded response for {0} {1}", method, path
+                ))
+            if len(responses) > 1:
+                status, body = responses.popleft()
+            else:
+                status, body = responses[0]
+
+        if isinstance(body, str):
+            content = body.encode("utf-8")
+        else:
+            content = json.dumps(body).encode("utf-8")
+        return Response(status, content)
+
+
+def make_token(expires_in=3600, claims=None):
+    """Return an unsigned JWT accepted by the client, for offline use."""
+    def encode(data):
+        raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+    return ".".join([
+        encode({'alg': 'HS256', 'typ': 'JWT'}),
+        encode(dict(claims or {}, exp=int(time.time() + expires_in))),
+        encode("offline"),
+    ])
+
+
+def _auth_response(path):
+    if path == API_PATH_APP_SIGNUP:
+        return Response(201, b"{}")
+    status = 200 if path == API_PATH_LOGIN else 201
+    body = {'token': make_token(), 'refresh_token': make_token()}
+    return Response(status, json.dumps(body).encode("utf-8"))
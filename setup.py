@@ -22,4 +22,11 @@ setuptools.setup(
         "PyJWT==1.7.1",
         "requests==2.25.1",
     ],
+    entry_points={
+        "console_scripts": [
+            "pyevacalor=pyevacalor.cli:main",
+            "pyevacalor-loadtest=pyevacalor.loadtest:main",
+            "pyevacalor-gateway=pyevacalor.gateway:main",
+        ],
+    },
 )
@@ -0,0 +1,89 @@
+"""Tests of the streaming registers map parser"""
+import json
+import unittest
+
+from pyevacalor import decoding
+from pyevacalor.fakeapi import PRODUCT_ID, make_registers_map
+
+CHUNK_SIZES = (1, 2, 3, 7, 64, 16384)
+
+
+def _registers_map(map_id, registers, id_first=True):
+    entry = make_registers_map(map_id, registers)
+    # Nested "id" keys must not be taken for the entry's own id.
+    entry['registers'][0]['id'] = 1
+    entry['registers'][1]['enc_val'].append({
+        'lang': "FRA", 'description': 'Allumé "ON" \\ 温度', 'value': 1,
+        'id': 3,
+    })
+    entry['registers'][2]['formula'] = "#/2 °C"
+    if id_first:
+        return entry
+    return dict(
+        [(key, value) for key, value in entry.items() if key != 'id']
+        + [('id', map_id)]
+    )
+
+
+def _response(map_ids, id_first=True, registers=12):
+    return {
+        # A registers_map array outside device_registers_map comes first.
+        'meta': {'registers_map': [{'id': 3, 'registers': []}]},
+        'device_registers_map': {
+            'name': "map \"x\" ]}",
+            'registers_map': [
+                _registers_map(map_id, registers, id_first)
+                for map_id in map_ids
+            ],
+        },
+    }
+
+
+def _chunks(body, size):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+class ParseRegistersMapStreamTest(unittest.TestCase):
+
+    def assert_same_as_parse(self, res, id_registers_map):
+        expected = decoding.parse_registers_map(
+            res, PRODUCT_ID, id_registers_map
+        )
+        for ensure_ascii in (True, False):
+            body = json.dumps(res, ensure_ascii=ensure_ascii).encode("utf-8")
+            for size in CHUNK_SIZES:
+                actual = decoding.parse_registers_map_stream(
+                    _chunks(body, size), PRODUCT_ID, id_registers_map
+                )
+                if expected is None:
+                    self.assertIsNone(actual)
+                else:
+                    self.assertIsNotNone(actual, size)
+                    self.assertEqual(dict(actual), dict(expected), size)
+
+    def test_matches_parse_registers_map(self):
+        for id_first in (True, False):
+            res = _response((1, 2, 3, 4), id_first)
+            for id_registers_map in (1, 3, 4):
+                self.assert_same_as_parse(res, id_registers_map)
+
+    def test_missing_map(self):
+        self.assert_same_as_parse(_response((1, 2)), 3)
+        self.assert_same_as_parse(_response(()), 3)
+
+    def test_only_array_under_device_registers_map(self):
+        res = {'registers_map': [{'id': 3, 'registers': []}]}
+        self.assertIsNone(decoding.parse_registers_map_stream(
+            [json.dumps(res).encode()], PRODUCT_ID, 3
+        ))
+
+    def test_truncated_response(self):
+        body = json.dumps(_response((1, 2, 3))).encode()
+        with self.assertRaises(ValueError):
+            decoding.parse_registers_map_stream(
+                _chunks(body[:len(body) // 2], 5), PRODUCT_ID, 3
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""Tests of the JobTracker polling device jobs"""
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import CancelledError
+
+from pyevacalor.client import evacalor
+from pyevacalor.const import API_PATH_DEVICE_BUFFER_READING, API_URL
+from pyevacalor.fakeapi import FakeAguaApi
+from pyevacalor.transport import Response
+
+
+class _BusyApi(FakeAguaApi):
+    """FakeAguaApi answering job status requests without a status"""
+
+    def request(self, method, url, payload, headers, timeout=None):
+        if "deviceJobStatus" in url:
+            return Response(200, b'{"message": "busy"}')
+        return super().request(method, url, payload, headers, timeout)
+
+
+class JobTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = FakeAguaApi()
+        self.client = evacalor(
+            FakeAguaApi.account_email(0), "secret", "test",
+            transport=self.api,
+        )
+        self.client.job_poll_interval = 0.05
+        self.tracker = self.client._get_job_tracker()
+
+    def tearDown(self):
+        self.client.close()
+
+    def start_job(self, latency=0.0):
+        self.api.job_latency = latency
+        res = self.client.handle_webcall(
+            "POST", API_URL + API_PATH_DEVICE_BUFFER_READING,
+            json.dumps({
+                'id_device': self.client.devices[0].id_device,
+                'id_product': self.client.devices[0].id_product,
+                'BufferId': 1,
+            })
+        )
+        return res['idRequest']
+
+    def wait_idle(self):
+        deadline = time.monotonic() + 5
+        while self.tracker._thread is not None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_completed(self):
+        handle = self.tracker.track(self.start_job())
+        self.assertEqual(handle.result(5)['jobAnswerStatus'], "completed")
+
+    def test_deadline_resolves_with_last_response(self):
+        statuses = list()
+        handle = self.tracker.track(
+            self.start_job(latency=60), timeout=0.3,
+            on_status=statuses.append
+        )
+        self.assertEqual(handle.result(5), {'jobAnswerStatus': "pending"})
+        self.assertIn("pending", statuses)
+
+    def test_cancel_event(self):
+        cancel_event = threading.Event()
+        handle = self.tracker.track(
+            self.start_job(latency=60), timeout=30, cancel_event=cancel_event
+        )
+        cancel_event.set()
+        with self.assertRaises(CancelledError):
+            handle.result(5)
+        self.assertFalse(self.client.wait_job(
+            self.start_job(latency=60), cancel_event=cancel_event
+        ))
+
+    def test_poll_exception_resolves_handle(self):
+        self.client.transport = _BusyApi()
+        handle = self.tracker.track("job1", timeout=30)
+        with self.assertRaises(KeyError):
+            handle.result(5)
+
+    def test_on_status_exception_resolves_handle(self):
+        def on_status(status):
+            raise ValueError(status)
+
+        handle = self.tracker.track(
+            self.start_job(latency=60), timeout=30, on_status=on_status
+        )
+        with self.assertRaises(ValueError):
+            handle.result(5)
+
+    def test_threads_exit_when_idle(self):
+        self.tracker.track(self.start_job()).result(5)
+        self.wait_idle()
+        self.assertIsNone(self.tracker._executor)
+        names = [thread.name for thread in threading.enumerate()]
+        self.assertNotIn("pyevacalor-jobs", names)
+
+        handle = self.tracker.track(self.start_job())
+        self.assertEqual(handle.result(5)['jobAnswerStatus'], "completed")
+        self.wait_idle()
+
+
+if __name__ == "__main__":
+    unittest.main()